@@ -3,6 +3,10 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve with e.g. ``uvicorn config.asgi:application --workers 4`` and
+SEARCH_ASYNC_VIEWS=1 so search requests are encoded in micro-batches
+(core.services.query_encoder).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
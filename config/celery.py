@@ -1,9 +1,20 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 app = Celery('config')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def warmup_sbert_model(**kwargs):
+    """Warm up the model in each forked worker; the weights were preloaded pre-fork."""
+    from django.conf import settings
+
+    if settings.SBERT_PRELOAD:
+        from core.services.embeddings import warmup_model
+        warmup_model()
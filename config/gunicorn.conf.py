@@ -0,0 +1,27 @@
+"""
+Gunicorn settings: gunicorn -c config/gunicorn.conf.py config.wsgi
+
+With SBERT_PRELOAD=1 the app (and the SBERT weights) is loaded once in the
+master before forking so workers share the weights copy-on-write, and each
+worker runs a warmup encode before accepting requests. The published
+in-process vector index (VECTOR_SEARCH_BACKEND 'numpy' or 'hnswlib') is also
+loaded in the master, so an hnswlib graph is shared copy-on-write too.
+"""
+
+preload_app = True
+
+
+def when_ready(server):
+    from django.conf import settings
+
+    if settings.VECTOR_SEARCH_BACKEND != 'pgvector':
+        from core.services.ann import get_index
+        get_index()
+
+
+def post_fork(server, worker):
+    from django.conf import settings
+
+    if settings.SBERT_PRELOAD:
+        from core.services.embeddings import warmup_model
+        warmup_model()
@@ -132,6 +132,20 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'query_embeddings': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('QUERY_CACHE_REDIS_URL', 'redis://localhost:6379/1'),
+    },
+}
+
+
 # Celery
 
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
@@ -147,3 +161,159 @@ CELERY_TASK_TIME_LIMIT = 7200
 
 SBERT_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
 SBERT_VECTOR_DIMENSIONS = 384
+
+# Inference backend: 'torch' (fp32), 'onnx' or 'onnx-int8' (dynamic int8
+# quantization; needs `pip install "sentence-transformers[onnx]"`).
+# SBERT_ONNX_QUANTIZATION picks the int8 kernel set: avx2, avx512,
+# avx512_vnni or arm64.
+SBERT_BACKEND = os.environ.get('SBERT_BACKEND', 'torch')
+SBERT_ONNX_QUANTIZATION = os.environ.get('SBERT_ONNX_QUANTIZATION', 'avx2')
+SBERT_ONNX_DIR = os.environ.get('SBERT_ONNX_DIR', str(BASE_DIR / 'models' / 'sbert-onnx'))
+
+# Token-based chunking: overlap between consecutive chunks and the max chunks
+# embedded per company (head + evenly sampled windows beyond that, 0 = no cap)
+SBERT_CHUNK_OVERLAP_TOKENS = int(os.environ.get('SBERT_CHUNK_OVERLAP_TOKENS', 16))
+SBERT_MAX_CHUNKS = int(os.environ.get('SBERT_MAX_CHUNKS', 16))
+
+# Reuse chunk vectors from the persistent ChunkEmbedding cache when embedding
+SBERT_CHUNK_CACHE = os.environ.get('SBERT_CHUNK_CACHE', '1').lower() in ('1', 'true', 'yes')
+
+# Load the model at app startup (before gunicorn/Celery fork) and warm it up
+# in each worker process; enable for web and worker processes only
+SBERT_PRELOAD = os.environ.get('SBERT_PRELOAD', '').lower() in ('1', 'true', 'yes')
+
+# Number of ScrapedData rows read, embedded and saved per window
+EMBEDDING_WINDOW_SIZE = int(os.environ.get('EMBEDDING_WINDOW_SIZE', 2048))
+
+# Sharded embedding (dispatch_embedding_shards_task): companies per shard and
+# the Celery queue shards are routed to (None = default queue). Run one worker
+# process per shard with e.g. `celery -A config worker -Q embeddings -c 4`
+# and set SBERT_NUM_THREADS so concurrency * threads matches the cores.
+EMBEDDING_SHARD_SIZE = int(os.environ.get('EMBEDDING_SHARD_SIZE', 20000))
+EMBEDDING_QUEUE = os.environ.get('EMBEDDING_QUEUE') or None
+SBERT_NUM_THREADS = int(os.environ.get('SBERT_NUM_THREADS', 0)) or None
+
+# Search query embedding cache: in-process LRU size, shared cache alias
+# (see CACHES) and shared entry lifetime in seconds
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 2048))
+QUERY_CACHE_ALIAS = 'query_embeddings'
+QUERY_CACHE_TIMEOUT = 7 * 24 * 3600
+
+# Most company ids or queries accepted by one /api/similar/batch/ or
+# /api/search/batch/ request
+SEARCH_BATCH_MAX_ITEMS = int(os.environ.get('SEARCH_BATCH_MAX_ITEMS', 1000))
+
+# ASGI deployments (config/asgi.py) serve /api/search/ and /api/search/batch/
+# from async views that encode queries in micro-batches: concurrent queries
+# are collected for up to QUERY_BATCH_MAX_WAIT_MS or QUERY_BATCH_MAX_SIZE
+# queries and encoded together (core.services.query_encoder)
+SEARCH_ASYNC_VIEWS = os.environ.get('SEARCH_ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+QUERY_BATCH_MAX_SIZE = int(os.environ.get('QUERY_BATCH_MAX_SIZE', 64))
+QUERY_BATCH_MAX_WAIT_MS = float(os.environ.get('QUERY_BATCH_MAX_WAIT_MS', 5))
+
+# Vector search: HNSW index used for candidate search ('vector', 'halfvec' or
+# 'bit', see core.services.search) and how many candidates compact modes
+# re-rank exactly against the full vectors
+VECTOR_SEARCH_INDEX = os.environ.get('VECTOR_SEARCH_INDEX', 'vector')
+VECTOR_RERANK_CANDIDATES = int(os.environ.get('VECTOR_RERANK_CANDIDATES', 100))
+
+# Filtered searches use pgvector (>= 0.8) iterative index scans:
+# 'relaxed_order' or 'strict_order', stopping after VECTOR_MAX_SCAN_TUPLES
+# rows. Per-query ef_search (the `ef` API parameter) is capped at
+# VECTOR_MAX_EF_SEARCH. Countries in VECTOR_PARTIAL_INDEX_COUNTRIES get their
+# own partial HNSW index (manage.py sync_vector_indexes).
+VECTOR_ITERATIVE_SCAN = os.environ.get('VECTOR_ITERATIVE_SCAN', 'relaxed_order')
+VECTOR_MAX_SCAN_TUPLES = int(os.environ.get('VECTOR_MAX_SCAN_TUPLES', 20000))
+VECTOR_MAX_EF_SEARCH = int(os.environ.get('VECTOR_MAX_EF_SEARCH', 1000))
+VECTOR_PARTIAL_INDEX_COUNTRIES = [
+    code.strip().upper()
+    for code in os.environ.get('VECTOR_PARTIAL_INDEX_COUNTRIES', 'IT').split(',')
+    if code.strip()
+]
+
+# Unfiltered similarity and search queries can run on an in-process index
+# instead of pgvector (core.services.ann): 'pgvector', 'numpy' (exact, for
+# small corpora) or 'hnswlib' (approximate, optional hnswlib package). Indexes
+# are built into ANN_INDEX_DIR after embedding runs (manage.py build_ann_index)
+# and workers pick up a newly published one within ANN_RELOAD_INTERVAL seconds.
+VECTOR_SEARCH_BACKEND = os.environ.get('VECTOR_SEARCH_BACKEND', 'pgvector')
+ANN_INDEX_DIR = os.environ.get('ANN_INDEX_DIR', str(BASE_DIR / 'artifacts' / 'ann'))
+ANN_RELOAD_INTERVAL = float(os.environ.get('ANN_RELOAD_INTERVAL', 5))
+ANN_BLOCK_SIZE = int(os.environ.get('ANN_BLOCK_SIZE', 65536))
+ANN_EF_SEARCH = int(os.environ.get('ANN_EF_SEARCH', 64))
+
+# /api/similar/ reads each company's SIMILAR_NEIGHBORS_K nearest companies
+# from CompanyNeighbors, precomputed by core.services.neighbors across
+# NEIGHBORS_WORKERS threads in NEIGHBORS_BLOCK_SIZE-square blocks of scores
+SIMILAR_NEIGHBORS_K = int(os.environ.get('SIMILAR_NEIGHBORS_K', 50))
+NEIGHBORS_WORKERS = int(os.environ.get('NEIGHBORS_WORKERS', os.cpu_count() or 1))
+NEIGHBORS_BLOCK_SIZE = int(os.environ.get('NEIGHBORS_BLOCK_SIZE', 4096))
+
+
+# Projections
+
+# Fitted projection models (UMAP reducers, clusterer) are stored here, one
+# directory per stage and refit; only the newest PROJECTION_ARTIFACTS_KEEP
+# versions of each stage are kept
+PROJECTION_ARTIFACT_DIR = os.environ.get('PROJECTION_ARTIFACT_DIR', str(BASE_DIR / 'artifacts' / 'projections'))
+PROJECTION_ARTIFACTS_KEEP = 3
+
+# Each projection run writes a new snapshot (ProjectionRun) and atomically
+# activates it; the newest PROJECTION_RUNS_KEEP finished runs are kept for
+# rollback with `manage.py projection_runs --activate`
+PROJECTION_RUNS_KEEP = int(os.environ.get('PROJECTION_RUNS_KEEP', 3))
+
+# Compressed /api/map-data/ payloads, rendered once per projection run, and
+# how long clients may reuse them before revalidating with their ETag
+MAP_SNAPSHOT_DIR = os.environ.get('MAP_SNAPSHOT_DIR', str(BASE_DIR / 'artifacts' / 'map'))
+MAP_CACHE_MAX_AGE = int(os.environ.get('MAP_CACHE_MAX_AGE', 60))
+
+# Tiled map API (core.services.tiles): zoom levels below MAP_TILE_DETAIL_ZOOM
+# are served from per-run summaries on a grid of MAP_TILE_BINS cells per tile
+# and axis; from it on, up to MAP_TILE_POINT_LIMIT points per viewport. The
+# map loads everything at once (binary snapshot) up to MAP_FULL_LOAD_LIMIT points.
+MAP_TILE_BINS = int(os.environ.get('MAP_TILE_BINS', 16))
+MAP_TILE_DETAIL_ZOOM = int(os.environ.get('MAP_TILE_DETAIL_ZOOM', 5))
+MAP_TILE_POINT_LIMIT = int(os.environ.get('MAP_TILE_POINT_LIMIT', 5000))
+MAP_FULL_LOAD_LIMIT = int(os.environ.get('MAP_FULL_LOAD_LIMIT', 50000))
+
+# Full refits fit UMAP on a stratified sample of UMAP_LANDMARKS embeddings
+# (0 = fit on everything) and place the rest with transform() across
+# UMAP_TRANSFORM_WORKERS processes (threads in a daemonic worker, see
+# PROJECTION_QUEUE). A deterministic fit is reproducible but
+# single-threaded; otherwise UMAP uses UMAP_N_JOBS threads.
+UMAP_LANDMARKS = int(os.environ.get('UMAP_LANDMARKS', 50000))
+UMAP_DETERMINISTIC = os.environ.get('UMAP_DETERMINISTIC', '1').lower() in ('1', 'true', 'yes')
+UMAP_N_JOBS = int(os.environ.get('UMAP_N_JOBS', -1))
+UMAP_TRANSFORM_WORKERS = int(os.environ.get('UMAP_TRANSFORM_WORKERS', os.cpu_count() or 1))
+
+# Clusters are found in a separate CLUSTER_UMAP_COMPONENTS-d UMAP space, not
+# in the 2-D map coordinates. HDBSCAN's minimum cluster size is
+# CLUSTER_MIN_SIZE_FRACTION of the corpus (at least CLUSTER_MIN_SIZE);
+# min_samples defaults to a quarter of it. Core distances are computed on
+# HDBSCAN_N_JOBS cores.
+CLUSTER_UMAP_COMPONENTS = int(os.environ.get('CLUSTER_UMAP_COMPONENTS', 15))
+CLUSTER_UMAP_NEIGHBORS = int(os.environ.get('CLUSTER_UMAP_NEIGHBORS', 30))
+CLUSTER_MIN_SIZE = int(os.environ.get('CLUSTER_MIN_SIZE', 5))
+CLUSTER_MIN_SIZE_FRACTION = float(os.environ.get('CLUSTER_MIN_SIZE_FRACTION', 0.0005))
+CLUSTER_MIN_SAMPLES = int(os.environ.get('CLUSTER_MIN_SAMPLES', 0)) or None
+HDBSCAN_N_JOBS = int(os.environ.get('HDBSCAN_N_JOBS', -1))
+
+# Celery queue of the projection tasks (None = default queue). Prefork pool
+# children are daemonic and can't start the UMAP transform workers, and fall
+# back to threads for HDBSCAN, so consume it with a non-daemon pool, e.g.
+# `celery -A config worker -Q projections --pool solo`.
+PROJECTION_QUEUE = os.environ.get('PROJECTION_QUEUE') or None
+if PROJECTION_QUEUE:
+    CELERY_TASK_ROUTES = {
+        f'core.tasks.{name}': {'queue': PROJECTION_QUEUE}
+        for name in (
+            'compute_projections_task', 'compute_display_projection_task',
+            'compute_clusters_task', 'full_pipeline_task',
+        )
+    }
+
+# Full-table vector loads (core.services.vectors) are cached here as .npy
+# files keyed by the embedding version and reopened memory-mapped
+VECTOR_CACHE = os.environ.get('VECTOR_CACHE', '1').lower() in ('1', 'true', 'yes')
+VECTOR_CACHE_DIR = os.environ.get('VECTOR_CACHE_DIR', str(BASE_DIR / 'artifacts' / 'vectors'))
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Company, ScrapedData, CompanyEmbedding
+from .models import (
+    Company, ScrapedData, CompanyEmbedding, CompanyNeighbors, ChunkEmbedding, ProjectionRun, ProjectionPoint,
+)
 
 
 @admin.register(Company)
@@ -17,6 +19,32 @@ class ScrapedDataAdmin(admin.ModelAdmin):
 
 @admin.register(CompanyEmbedding)
 class CompanyEmbeddingAdmin(admin.ModelAdmin):
-    list_display = ('company', 'cluster_id', 'cluster_label', 'umap_x', 'umap_y', 'created_at')
-    list_filter = ('cluster_label',)
+    list_display = ('company', 'model_name', 'embedded_at', 'created_at')
+    list_filter = ('model_name',)
     raw_id_fields = ('company',)
+
+
+@admin.register(CompanyNeighbors)
+class CompanyNeighborsAdmin(admin.ModelAdmin):
+    list_display = ('company', 'computed_at')
+    raw_id_fields = ('company',)
+
+
+@admin.register(ProjectionRun)
+class ProjectionRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'is_active', 'display_version', 'clusters_version', 'started_at', 'finished_at')
+    list_filter = ('status', 'is_active')
+
+
+@admin.register(ProjectionPoint)
+class ProjectionPointAdmin(admin.ModelAdmin):
+    list_display = ('company', 'run', 'cluster_id', 'cluster_label', 'umap_x', 'umap_y')
+    list_filter = ('run',)
+    raw_id_fields = ('company', 'run')
+
+
+@admin.register(ChunkEmbedding)
+class ChunkEmbeddingAdmin(admin.ModelAdmin):
+    list_display = ('text_hash', 'model_name', 'created_at')
+    list_filter = ('model_name',)
+    search_fields = ('text_hash',)
@@ -0,0 +1,27 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from core.services import ann
+
+
+class Command(BaseCommand):
+    help = 'Build and publish the in-process vector index used by VECTOR_SEARCH_BACKEND'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend',
+            choices=ann.ANN_BACKENDS,
+            help='Index to build (default: VECTOR_SEARCH_BACKEND)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild even if an index exists for the current embedding version',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            version = ann.build_index(options['backend'], force=options['force'])
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Published index {version}'))
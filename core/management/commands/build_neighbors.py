@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.services.neighbors import build_neighbors
+
+
+class Command(BaseCommand):
+    help = "Precompute every company's nearest neighbours for /api/similar/"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, help='Neighbours per company (default: SIMILAR_NEIGHBORS_K)')
+
+    def handle(self, *args, **options):
+        written = build_neighbors(options['k'])
+        self.stdout.write(self.style.SUCCESS(f'Stored neighbours of {written} companies'))
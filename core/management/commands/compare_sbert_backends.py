@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core.models import ScrapedData
+from core.services.embeddings import SBERT_BACKENDS, embed_texts_batch, load_model
+
+
+class Command(BaseCommand):
+    help = 'Compare an SBERT inference backend against the fp32 torch baseline on sampled data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend',
+            default='onnx-int8',
+            choices=[b for b in SBERT_BACKENDS if b != 'torch'],
+            help='Backend to compare against torch (default: onnx-int8)',
+        )
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=500,
+            help='Number of random scraped pages to embed (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        texts = list(
+            ScrapedData.objects.order_by('?')
+            .values_list('text_content', flat=True)[:options['sample']]
+        )
+        if not texts:
+            self.stdout.write(self.style.WARNING('No scraped data to sample'))
+            return
+        self.stdout.write(f'Sampled {len(texts)} pages')
+
+        results = {}
+        for backend in ('torch', options['backend']):
+            model = load_model(backend)
+            embed_texts_batch(texts[:8], model=model, cache=False)  # warmup
+            start = time.perf_counter()
+            results[backend] = (
+                embed_texts_batch(texts, model=model, cache=False), time.perf_counter() - start,
+            )
+            self.stdout.write(f'{backend}: {results[backend][1]:.2f}s')
+
+        baseline, baseline_time = results['torch']
+        candidate, candidate_time = results[options['backend']]
+        baseline = baseline / np.linalg.norm(baseline, axis=1, keepdims=True)
+        candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+        cosines = np.einsum('ij,ij->i', baseline, candidate)
+
+        self.stdout.write(
+            f'Cosine agreement: mean={cosines.mean():.4f} '
+            f'p1={np.percentile(cosines, 1):.4f} min={cosines.min():.4f}'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Speedup of {options["backend"]} over torch: {baseline_time / candidate_time:.2f}x'
+        ))
@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from pgvector.django import CosineDistance
+
+from core.models import CompanyEmbedding
+from core.services.ann import ANN_BACKENDS, get_index
+from core.services.search import SEARCH_MODES, nearest_embeddings
+
+
+class Command(BaseCommand):
+    help = 'Measure recall@k and latency of each vector search mode and in-process index against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=100, help='Number of sampled companies used as queries')
+        parser.add_argument('--k', type=int, default=10, help='Neighbours per query (default: 10)')
+        parser.add_argument(
+            '--modes',
+            nargs='+',
+            default=list(SEARCH_MODES),
+            choices=SEARCH_MODES + ANN_BACKENDS,
+            help='pgvector search modes and in-process indexes (see build_ann_index) to evaluate',
+        )
+
+    def _exact(self, target, k):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_indexscan = off')
+            return [
+                emb.company_id for emb in
+                CompanyEmbedding.objects.exclude(company_id=target.company_id)
+                .annotate(distance=CosineDistance('vector', target.vector))
+                .order_by('distance')[:k]
+            ]
+
+    def handle(self, *args, **options):
+        k = options['k']
+        targets = list(CompanyEmbedding.objects.order_by('?')[:options['queries']])
+        if not targets:
+            self.stdout.write(self.style.WARNING('No embeddings to evaluate'))
+            return
+
+        truth = [set(self._exact(target, k)) for target in targets]
+        self.stdout.write(f'Computed exact top-{k} for {len(targets)} queries')
+
+        for mode in options['modes']:
+            if mode in ANN_BACKENDS and get_index(mode) is None:
+                self.stdout.write(self.style.WARNING(f'{mode}: no published index, run build_ann_index'))
+                continue
+            hits = 0
+            elapsed = 0.0
+            for target, expected in zip(targets, truth):
+                start = time.perf_counter()
+                if mode in ANN_BACKENDS:
+                    found = nearest_embeddings(target.vector, k, exclude_company_id=target.company_id, backend=mode)
+                else:
+                    found = nearest_embeddings(
+                        target.vector, k, exclude_company_id=target.company_id, mode=mode, backend='pgvector',
+                    )
+                elapsed += time.perf_counter() - start
+                hits += len(expected & {emb.company_id for emb in found})
+            self.stdout.write(
+                f'{mode}: recall@{k}={hits / (k * len(targets)):.4f} '
+                f'mean latency={1000 * elapsed / len(targets):.1f}ms'
+            )
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Export the SBERT model to ONNX and a dynamically int8-quantized variant'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir',
+            default=None,
+            help=f'Target directory (default: SBERT_ONNX_DIR, {settings.SBERT_ONNX_DIR})',
+        )
+
+    def handle(self, *args, **options):
+        from core.services.embeddings import export_onnx_model
+
+        output_dir = export_onnx_model(options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported ONNX model ({settings.SBERT_ONNX_QUANTIZATION} int8 variant) to {output_dir}'
+        ))
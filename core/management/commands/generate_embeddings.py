@@ -16,23 +16,51 @@ class Command(BaseCommand):
             action='store_true',
             help='Only compute UMAP projections and HDBSCAN clusters',
         )
+        parser.add_argument(
+            '--stage',
+            choices=['display', 'clusters'],
+            help='With --projections-only, run only the display projection or the clustering stage',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-embed every company, even if its text and model are unchanged',
+        )
+
+        parser.add_argument(
+            '--refit',
+            action='store_true',
+            help='Refit UMAP/HDBSCAN on all embeddings instead of projecting only new ones',
+        )
+        parser.add_argument(
+            '--sharded',
+            action='store_true',
+            help='Fan embedding out over Celery workers in company-id shards (implies --async)',
+        )
 
     def handle(self, *args, **options):
-        if options['run_async']:
+        from core.tasks import PROJECTION_STAGES
+        stages = [options['stage']] if options['stage'] else list(PROJECTION_STAGES)
+
+        if options['sharded'] and not options['projections_only']:
+            from core.tasks import dispatch_embedding_shards_task
+            result = dispatch_embedding_shards_task.delay(force=options['force'])
+            self.stdout.write(f'Dispatched sharded embedding task: {result.id}')
+        elif options['run_async']:
             if options['projections_only']:
                 from core.tasks import compute_projections_task
-                result = compute_projections_task.delay()
+                result = compute_projections_task.delay(refit=options['refit'], stages=stages)
                 self.stdout.write(f'Dispatched projections task: {result.id}')
             else:
                 from core.tasks import full_pipeline_task
-                result = full_pipeline_task.delay()
+                result = full_pipeline_task.delay(force=options['force'], refit=options['refit'])
                 self.stdout.write(f'Dispatched full pipeline task: {result.id}')
         else:
             if options['projections_only']:
                 from core.tasks import compute_projections_task
-                result = compute_projections_task()
+                result = compute_projections_task(refit=options['refit'], stages=stages)
                 self.stdout.write(self.style.SUCCESS(f'Projections: {result}'))
             else:
                 from core.tasks import full_pipeline_task
-                result = full_pipeline_task()
+                result = full_pipeline_task(force=options['force'], refit=options['refit'])
                 self.stdout.write(self.style.SUCCESS(f'Pipeline: {result}'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import ProjectionRun
+from core.services import projections
+
+
+class Command(BaseCommand):
+    help = 'List projection snapshots, roll back to an older one or delete old ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--activate',
+            type=int,
+            metavar='RUN_ID',
+            help='Make this finished run the active snapshot (rollback)',
+        )
+        parser.add_argument(
+            '--gc',
+            action='store_true',
+            help='Delete failed runs and finished runs beyond PROJECTION_RUNS_KEEP',
+        )
+
+    def handle(self, *args, **options):
+        if options['activate'] is not None:
+            try:
+                run = ProjectionRun.objects.get(pk=options['activate'])
+                projections.activate_run(run)
+            except (ProjectionRun.DoesNotExist, ValueError) as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(f'Activated projection run {run.pk}'))
+
+        if options['gc']:
+            deleted = projections.collect_garbage()
+            self.stdout.write(f'Deleted {deleted} projection runs')
+
+        for run in ProjectionRun.objects.order_by('-started_at'):
+            marker = '*' if run.is_active else ' '
+            self.stdout.write(
+                f'{marker} {run.pk:>5}  {run.status:<8}  {run.started_at:%Y-%m-%d %H:%M}  '
+                f'display={run.display_version or "-"}  clusters={run.clusters_version or "-"}'
+            )
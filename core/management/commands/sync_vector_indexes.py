@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.models import CompanyEmbedding
+from core.services.search import COMPACT_INDEXES, VECTOR_INDEX, partial_index_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the HNSW index used by VECTOR_SEARCH_INDEX (vector, halfvec or bit) '
+        'and the partial HNSW indexes for VECTOR_PARTIAL_INDEX_COUNTRIES'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drop-unused',
+            action='store_true',
+            help=(
+                'Drop HNSW indexes not used by the current settings, including the '
+                'full-precision index when a compact mode is active'
+            ),
+        )
+
+    def _create(self, cursor, table, name, expression, where=''):
+        self.stdout.write(f'Building {name} (this can take a while)...')
+        cursor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} '
+            f'USING hnsw ({expression}) '
+            f'WITH (m = 16, ef_construction = 64){where}'
+        )
+        self.stdout.write(self.style.SUCCESS(f'{name} ready'))
+
+    def handle(self, *args, **options):
+        table = CompanyEmbedding._meta.db_table
+        dims = settings.SBERT_VECTOR_DIMENSIONS
+        mode = settings.VECTOR_SEARCH_INDEX
+        indexes = {'vector': VECTOR_INDEX, **COMPACT_INDEXES}
+        wanted = set()
+
+        with connection.cursor() as cursor:
+            # All HNSW indexes are managed here, not by the migrations (the
+            # full-precision one was created by 0002 and handed over by 0009)
+            for index_mode, (name, expression) in indexes.items():
+                if index_mode == mode:
+                    self._create(cursor, table, name, expression.format(dims=dims))
+                    wanted.add(name)
+
+            # Partial indexes of the index the current mode searches
+            base, expression = indexes[mode]
+            for country_code in settings.VECTOR_PARTIAL_INDEX_COUNTRIES:
+                if not country_code.isalnum():
+                    self.stderr.write(f'Skipping invalid country code {country_code!r}')
+                    continue
+                name = partial_index_name(base, country_code)
+                where = f" WHERE country_code = '{country_code}'"
+                self._create(cursor, table, name, expression.format(dims=dims), where)
+                wanted.add(name)
+
+            if options['drop_unused']:
+                managed = [name for name, _expression in indexes.values()]
+                cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+                for (name,) in cursor.fetchall():
+                    if name in wanted:
+                        continue
+                    if any(name == base or name.startswith(f'{base}_') for base in managed):
+                        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+                        self.stdout.write(f'Dropped {name}')
@@ -0,0 +1,32 @@
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapeddata',
+            name='content_hash',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.MD5('text_content'), help_text='Fingerprint of text_content, maintained by the database', output_field=models.CharField(max_length=32)),
+        ),
+        migrations.AddField(
+            model_name='companyembedding',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='ScrapedData.content_hash that was embedded', max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='companyembedding',
+            name='model_name',
+            field=models.CharField(blank=True, help_text='SBERT model that produced the vector', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='companyembedding',
+            name='embedded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+import pgvector.django
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_embedding_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_hash', models.CharField(help_text='MD5 of the normalized chunk text', max_length=32)),
+                ('model_name', models.CharField(max_length=255)),
+                ('vector', pgvector.django.VectorField(dimensions=384)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('model_name', 'text_hash'), name='unique_chunk_embedding'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,88 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Existing coordinates and clusters become the first, active snapshot.
+SEED_SNAPSHOT = """
+WITH run AS (
+    INSERT INTO core_projectionrun (status, is_active, stats, started_at, finished_at)
+    SELECT 'ready', true, '{}'::jsonb, now(), now()
+    WHERE EXISTS (
+        SELECT 1 FROM core_companyembedding
+        WHERE umap_x IS NOT NULL OR cluster_id IS NOT NULL
+    )
+    RETURNING id
+)
+INSERT INTO core_projectionpoint (run_id, company_id, umap_x, umap_y, cluster_id, cluster_label)
+SELECT run.id, e.company_id, e.umap_x, e.umap_y, e.cluster_id, e.cluster_label
+FROM core_companyembedding e CROSS JOIN run
+WHERE e.umap_x IS NOT NULL OR e.cluster_id IS NOT NULL
+"""
+
+RESTORE_COLUMNS = """
+UPDATE core_companyembedding e
+SET umap_x = p.umap_x, umap_y = p.umap_y, cluster_id = p.cluster_id, cluster_label = p.cluster_label
+FROM core_projectionpoint p JOIN core_projectionrun r ON r.id = p.run_id
+WHERE r.is_active AND p.company_id = e.company_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_chunk_embedding_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectionRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('building', 'Building'), ('ready', 'Ready'), ('failed', 'Failed')], default='building', max_length=15)),
+                ('is_active', models.BooleanField(default=False, help_text='The snapshot readers are served from')),
+                ('display_version', models.CharField(blank=True, help_text='Display projection artifacts used', max_length=32, null=True)),
+                ('clusters_version', models.CharField(blank=True, help_text='Clustering artifacts used', max_length=32, null=True)),
+                ('stats', models.JSONField(blank=True, default=dict)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='single_active_projection_run'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProjectionPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('umap_x', models.FloatField(blank=True, null=True)),
+                ('umap_y', models.FloatField(blank=True, null=True)),
+                ('cluster_id', models.IntegerField(blank=True, null=True)),
+                ('cluster_label', models.CharField(blank=True, max_length=255, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='projection_points', to='core.company')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='points', to='core.projectionrun')),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('run', 'company'), name='unique_projection_point'),
+                ],
+            },
+        ),
+        migrations.RunSQL(SEED_SNAPSHOT, reverse_sql=RESTORE_COLUMNS),
+        migrations.RemoveField(
+            model_name='companyembedding',
+            name='cluster_id',
+        ),
+        migrations.RemoveField(
+            model_name='companyembedding',
+            name='cluster_label',
+        ),
+        migrations.RemoveField(
+            model_name='companyembedding',
+            name='umap_x',
+        ),
+        migrations.RemoveField(
+            model_name='companyembedding',
+            name='umap_y',
+        ),
+    ]
@@ -0,0 +1,49 @@
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_projection_snapshots'),
+    ]
+
+    operations = [
+        # GiST support for the run_id column of the viewport index
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name='projectionrun',
+            name='bounds',
+            field=models.JSONField(blank=True, help_text='[min_x, min_y, max_x, max_y] of the points, set with the tile cells', null=True),
+        ),
+        migrations.AddField(
+            model_name='projectionrun',
+            name='point_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='projectionpoint',
+            index=django.contrib.postgres.indexes.GistIndex(models.F('run'), models.Func(models.F('umap_x'), models.F('umap_y'), function='point'), name='projection_point_xy_gist_idx'),
+        ),
+        migrations.CreateModel(
+            name='ProjectionCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('cell_x', models.IntegerField()),
+                ('cell_y', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('x', models.FloatField(help_text="Centroid of the cell's points")),
+                ('y', models.FloatField(help_text="Centroid of the cell's points")),
+                ('cluster_id', models.IntegerField(blank=True, help_text='Most common cluster in the cell', null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='core.projectionrun')),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('run', 'zoom', 'cell_x', 'cell_y'), name='unique_projection_cell'),
+                ],
+            },
+        ),
+    ]
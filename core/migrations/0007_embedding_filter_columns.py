@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+BACKFILL = """
+UPDATE core_companyembedding e
+SET industry = c.industry, country_code = c.country_code, state = c.state, size = c.size
+FROM core_company c
+WHERE c.id = e.company_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_projection_tiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companyembedding',
+            name='industry',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='companyembedding',
+            name='country_code',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='companyembedding',
+            name='state',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='companyembedding',
+            name='size',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.RunSQL(BACKFILL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='companyembedding',
+            index=models.Index(fields=['country_code', 'state'], name='embedding_country_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='companyembedding',
+            index=models.Index(fields=['industry'], name='embedding_industry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='companyembedding',
+            index=models.Index(fields=['size'], name='embedding_size_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_embedding_filter_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyNeighbors',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbors', serialize=False, to='core.company')),
+                ('neighbor_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), help_text='Company ids, nearest first', size=None)),
+                ('distances', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), help_text='Cosine distances of neighbor_ids', size=None)),
+                ('computed_at', models.DateTimeField(help_text='Start of the build; stale if the company was re-embedded since')),
+            ],
+            options={
+                'verbose_name_plural': 'company neighbors',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Hand embedding_hnsw_idx over to `manage.py sync_vector_indexes`, which
+    drops it in the compact search modes. Only the migration state changes:
+    the index created by 0002 stays in the database.
+    """
+
+    dependencies = [
+        ('core', '0008_company_neighbors'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveIndex(
+                    model_name='companyembedding',
+                    name='embedding_hnsw_idx',
+                ),
+            ],
+        ),
+    ]
@@ -1,5 +1,9 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GistIndex
 from django.db import models
-from pgvector.django import VectorField, HnswIndex
+from django.db.models import F, Func
+from django.db.models.functions import MD5
+from pgvector.django import VectorField
 
 
 class Company(models.Model):
@@ -46,6 +50,12 @@ class ScrapedData(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='scraped_data')
     text_content = models.TextField(help_text="Raw text content from the website")
     cleaned_content = models.TextField(help_text="Preprocessed logical tokens", blank=True, null=True)
+    content_hash = models.GeneratedField(
+        expression=MD5('text_content'),
+        output_field=models.CharField(max_length=32),
+        db_persist=True,
+        help_text="Fingerprint of text_content, maintained by the database",
+    )
     scraped_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -55,22 +65,131 @@ class ScrapedData(models.Model):
 class CompanyEmbedding(models.Model):
     company = models.OneToOneField(Company, on_delete=models.CASCADE, related_name='embedding')
     vector = VectorField(dimensions=384)
+    content_hash = models.CharField(max_length=32, blank=True, null=True, help_text="ScrapedData.content_hash that was embedded")
+    model_name = models.CharField(max_length=255, blank=True, null=True, help_text="SBERT model that produced the vector")
+    embedded_at = models.DateTimeField(blank=True, null=True)
+
+    # Search filters, denormalized from Company so filtered vector searches
+    # need no join (kept in sync by core.services.search.sync_filter_columns)
+    industry = models.CharField(max_length=255, blank=True, null=True)
+    country_code = models.CharField(max_length=10, blank=True, null=True)
+    state = models.CharField(max_length=255, blank=True, null=True)
+    size = models.CharField(max_length=50, blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['country_code', 'state'], name='embedding_country_state_idx'),
+            models.Index(fields=['industry'], name='embedding_industry_idx'),
+            models.Index(fields=['size'], name='embedding_size_idx'),
+            # The HNSW indexes (embedding_hnsw_idx and the compact ones) are
+            # managed by `manage.py sync_vector_indexes`, see
+            # core.services.search
+        ]
+
+    def __str__(self):
+        return f"Embedding for {self.company.name}"
+
+
+class CompanyNeighbors(models.Model):
+    """Precomputed nearest companies of a company (core.services.neighbors)."""
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, primary_key=True, related_name='neighbors')
+    neighbor_ids = ArrayField(models.BigIntegerField(), help_text="Company ids, nearest first")
+    distances = ArrayField(models.FloatField(), help_text="Cosine distances of neighbor_ids")
+    computed_at = models.DateTimeField(help_text="Start of the build; stale if the company was re-embedded since")
+
+    class Meta:
+        verbose_name_plural = 'company neighbors'
+
+    def __str__(self):
+        return f"Neighbors of {self.company.name}"
+
+
+class ProjectionRun(models.Model):
+    STATUS_CHOICES = [
+        ('building', 'Building'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='building')
+    is_active = models.BooleanField(default=False, help_text="The snapshot readers are served from")
+    display_version = models.CharField(max_length=32, blank=True, null=True, help_text="Display projection artifacts used")
+    clusters_version = models.CharField(max_length=32, blank=True, null=True, help_text="Clustering artifacts used")
+    stats = models.JSONField(default=dict, blank=True)
+    bounds = models.JSONField(blank=True, null=True, help_text="[min_x, min_y, max_x, max_y] of the points, set with the tile cells")
+    point_count = models.IntegerField(blank=True, null=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['is_active'],
+                condition=models.Q(is_active=True),
+                name='single_active_projection_run',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Projection run {self.pk} ({self.status})"
+
+
+class ProjectionPoint(models.Model):
+    run = models.ForeignKey(ProjectionRun, on_delete=models.CASCADE, related_name='points')
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='projection_points')
     umap_x = models.FloatField(blank=True, null=True)
     umap_y = models.FloatField(blank=True, null=True)
     cluster_id = models.IntegerField(blank=True, null=True)
     cluster_label = models.CharField(max_length=255, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'company'], name='unique_projection_point'),
+        ]
         indexes = [
-            HnswIndex(
-                name='embedding_hnsw_idx',
-                fields=['vector'],
-                opclasses=['vector_cosine_ops'],
-                m=16,
-                ef_construction=64,
+            # Viewport lookups: point(umap_x, umap_y) <@ box(...) within a run
+            GistIndex(
+                F('run'), Func(F('umap_x'), F('umap_y'), function='point'),
+                name='projection_point_xy_gist_idx',
             ),
         ]
 
     def __str__(self):
-        return f"Embedding for {self.company.name}"
+        return f"Point for company {self.company_id} in run {self.run_id}"
+
+
+class ProjectionCell(models.Model):
+    """Pre-aggregated grid cell of a run's map at a coarse tile zoom level."""
+    run = models.ForeignKey(ProjectionRun, on_delete=models.CASCADE, related_name='cells')
+    zoom = models.PositiveSmallIntegerField()
+    cell_x = models.IntegerField()
+    cell_y = models.IntegerField()
+    count = models.IntegerField()
+    x = models.FloatField(help_text="Centroid of the cell's points")
+    y = models.FloatField(help_text="Centroid of the cell's points")
+    cluster_id = models.IntegerField(blank=True, null=True, help_text="Most common cluster in the cell")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'zoom', 'cell_x', 'cell_y'], name='unique_projection_cell'),
+        ]
+
+    def __str__(self):
+        return f"Cell {self.zoom}/{self.cell_x}/{self.cell_y} of run {self.run_id}"
+
+
+class ChunkEmbedding(models.Model):
+    text_hash = models.CharField(max_length=32, help_text="MD5 of the normalized chunk text")
+    model_name = models.CharField(max_length=255)
+    vector = VectorField(dimensions=384)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model_name', 'text_hash'], name='unique_chunk_embedding'),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.text_hash} ({self.model_name})"
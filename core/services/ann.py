@@ -0,0 +1,252 @@
+"""
+In-process nearest-neighbour indexes over the embedding table.
+
+VECTOR_SEARCH_BACKEND picks where similarity and search queries run:
+'pgvector' (in Postgres, see core.services.search), 'numpy' (exact cosine
+search by blocked matrix products) or 'hnswlib' (approximate HNSW graph,
+needs the optional `hnswlib` package).
+
+build_index() snapshots the embedding table into
+ANN_INDEX_DIR/<backend>/<embedding_version()>/ and atomically points that
+backend's LATEST file at it. The numpy backend stores unit-normalized vectors as
+.npy files that every worker opens memory-mapped, so all gunicorn workers
+share one copy through the page cache. An hnswlib graph is loaded into
+memory; loaded before forking (preload_app) it is shared copy-on-write.
+get_index() checks LATEST at most every ANN_RELOAD_INTERVAL seconds and
+hot-swaps to a newly published index. Older versions are deleted once they
+are neither the previous one nor younger than ANN_RELOAD_INTERVAL, so
+workers that just read LATEST can still open them.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+ANN_BACKENDS = ('numpy', 'hnswlib')
+
+_loaded = {}  # backend -> (version, index)
+_checked_at = {}
+_lock = threading.Lock()
+
+
+def _root(backend):
+    return Path(settings.ANN_INDEX_DIR) / backend
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class ExactIndex:
+    """Exact cosine search over memory-mapped unit vectors, ANN_BLOCK_SIZE rows at a time."""
+
+    def __init__(self, company_ids, vectors):
+        self.company_ids = company_ids
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, directory, company_ids, vectors):
+        np.save(directory / 'ids.npy', np.asarray(company_ids, dtype=np.int64))
+        out = np.lib.format.open_memmap(
+            directory / 'vectors.npy', mode='w+', dtype=np.float32, shape=vectors.shape,
+        )
+        block = settings.ANN_BLOCK_SIZE
+        for start in range(0, len(vectors), block):
+            out[start:start + block] = _normalize(vectors[start:start + block])
+        out.flush()
+
+    @classmethod
+    def load(cls, directory):
+        return cls(
+            np.load(directory / 'ids.npy', mmap_mode='r'),
+            np.load(directory / 'vectors.npy', mmap_mode='r'),
+        )
+
+    def __len__(self):
+        return len(self.company_ids)
+
+    def search(self, vector, k, ef_search=None):
+        """Returns (company_ids, cosine distances) of the k nearest, nearest first."""
+        query = _normalize(vector)
+        k = min(k, len(self))
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        block = settings.ANN_BLOCK_SIZE
+        for start in range(0, len(self), block):
+            scores = self.vectors[start:start + block] @ query
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+        order = np.argsort(-best_scores)
+        return np.asarray(self.company_ids[best_rows[order]]), 1.0 - best_scores[order]
+
+
+class HnswlibIndex:
+    """Approximate cosine search on an hnswlib HNSW graph labelled with company ids."""
+
+    def __init__(self, index):
+        self.index = index
+
+    @staticmethod
+    def _hnswlib():
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImproperlyConfigured(
+                "VECTOR_SEARCH_BACKEND='hnswlib' requires the hnswlib package"
+            )
+        return hnswlib
+
+    @classmethod
+    def build(cls, directory, company_ids, vectors):
+        hnswlib = cls._hnswlib()
+        index = hnswlib.Index(space='cosine', dim=vectors.shape[1])
+        index.init_index(max_elements=max(1, len(vectors)), ef_construction=200, M=16)
+        block = settings.ANN_BLOCK_SIZE
+        for start in range(0, len(vectors), block):
+            index.add_items(
+                np.asarray(vectors[start:start + block]),
+                np.asarray(company_ids[start:start + block]),
+            )
+        index.save_index(str(directory / 'index.hnswlib'))
+
+    @classmethod
+    def load(cls, directory):
+        hnswlib = cls._hnswlib()
+        meta = json.loads((directory / 'meta.json').read_text())
+        index = hnswlib.Index(space='cosine', dim=meta['dims'])
+        index.load_index(str(directory / 'index.hnswlib'), max_elements=max(1, meta['count']))
+        return cls(index)
+
+    def __len__(self):
+        return self.index.get_current_count()
+
+    def search(self, vector, k, ef_search=None):
+        """Returns (company_ids, cosine distances) of the k nearest, nearest first."""
+        k = min(k, len(self))
+        if not k:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        self.index.set_ef(max(ef_search or settings.ANN_EF_SEARCH, k))
+        labels, distances = self.index.knn_query(np.asarray(vector, dtype=np.float32), k=k)
+        return labels[0].astype(np.int64), distances[0]
+
+
+_INDEX_CLASSES = {'numpy': ExactIndex, 'hnswlib': HnswlibIndex}
+
+
+def _backend(backend=None):
+    backend = backend or settings.VECTOR_SEARCH_BACKEND
+    if backend not in _INDEX_CLASSES:
+        raise ImproperlyConfigured(
+            f'{backend!r} has no in-process index, expected one of {", ".join(ANN_BACKENDS)}'
+        )
+    return backend
+
+
+def published_version(backend=None):
+    """Embedding version of the backend's published index, or None."""
+    try:
+        return (_root(_backend(backend)) / 'LATEST').read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def build_index(backend=None, force=False):
+    """
+    Build the index of `backend` (default VECTOR_SEARCH_BACKEND) for the
+    current embedding version and publish it. Returns the version; an index
+    already built for it is republished as is unless `force`.
+    """
+    from core.services.vectors import embedding_version, load_vectors
+
+    backend = _backend(backend)
+    root = _root(backend)
+    version = embedding_version()
+    directory = root / version
+    if force or not (directory / 'meta.json').exists():
+        company_ids, vectors = load_vectors()
+        tmp = root / f'{version}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        _INDEX_CLASSES[backend].build(tmp, company_ids, vectors)
+        # meta.json marks a complete index
+        (tmp / 'meta.json').write_text(json.dumps({
+            'count': len(company_ids), 'dims': int(vectors.shape[1]),
+        }))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+        logger.info('Built %s index %s over %d embeddings', backend, version, len(company_ids))
+
+    previous = published_version(backend)
+    pointer = root / f'LATEST.{os.getpid()}.tmp'
+    pointer.write_text(version)
+    os.replace(pointer, root / 'LATEST')
+    _prune(root, {version, previous})
+    return version
+
+
+def _prune(root, keep):
+    """
+    Delete the index directories of versions not in `keep`, except those
+    published within ANN_RELOAD_INTERVAL and other builders' `*.tmp` ones.
+    """
+    # Workers still mapping an older index keep reading it after its files are unlinked
+    cutoff = time.time() - settings.ANN_RELOAD_INTERVAL
+    for path in root.iterdir():
+        if not path.is_dir() or path.name in keep or path.name.endswith('.tmp'):
+            continue
+        try:
+            if path.stat().st_mtime > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_index(backend=None):
+    """
+    The published index of `backend` (default VECTOR_SEARCH_BACKEND), or None
+    if none is. A newly published index replaces the loaded one; if it can't
+    be loaded, the loaded one keeps being served.
+    """
+    backend = _backend(backend)
+    now = time.monotonic()
+    loaded = _loaded.get(backend)
+    if loaded is not None and now - _checked_at[backend] < settings.ANN_RELOAD_INTERVAL:
+        return loaded[1]
+
+    with _lock:
+        _checked_at[backend] = now
+        version = published_version(backend)
+        if version is None:
+            return None
+        loaded = _loaded.get(backend)
+        if loaded is None or loaded[0] != version:
+            try:
+                index = _INDEX_CLASSES[backend].load(_root(backend) / version)
+            except ImproperlyConfigured:
+                raise
+            except Exception:
+                logger.exception('Could not load %s index %s', backend, version)
+                return loaded[1] if loaded is not None else None
+            loaded = _loaded[backend] = (version, index)
+            logger.info('Loaded %s index %s', backend, version)
+    return loaded[1]
@@ -0,0 +1,73 @@
+"""
+Versioned on-disk artifacts of the projection stage.
+
+Artifacts are grouped by stage ('display' for the 2-D map projection,
+'clusters' for the clustering space and clusterer), so each stage can be
+refitted on its own. A refit writes its fitted models into
+PROJECTION_ARTIFACT_DIR/<stage>/<version>/ and then atomically repoints the
+stage's LATEST file at that version, so readers never see a half-written
+set. Only the newest PROJECTION_ARTIFACTS_KEEP versions per stage are kept.
+"""
+import os
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def _root(stage):
+    return Path(settings.PROJECTION_ARTIFACT_DIR) / stage
+
+
+def new_version():
+    """A sortable version id for a new set of artifacts."""
+    return timezone.now().strftime('%Y%m%dT%H%M%S%f')
+
+
+def latest_version(stage):
+    """Version id of the stage's current artifacts, or None if nothing was published yet."""
+    try:
+        return (_root(stage) / 'LATEST').read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_artifacts(stage, version, **objects):
+    """Persist objects as <name>.joblib under `version` and publish it as the stage's LATEST."""
+    import joblib
+
+    root = _root(stage)
+    directory = root / version
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, obj in objects.items():
+        joblib.dump(obj, directory / f'{name}.joblib')
+
+    pointer = root / 'LATEST.tmp'
+    pointer.write_text(version)
+    os.replace(pointer, root / 'LATEST')
+    _prune(stage)
+
+
+def load_artifact(stage, name, version=None):
+    """Load artifact `name` of `stage` from `version` (default LATEST); None if it does not exist."""
+    import joblib
+
+    version = version or latest_version(stage)
+    if version is None:
+        return None
+    path = _root(stage) / version / f'{name}.joblib'
+    if not path.exists():
+        return None
+    return joblib.load(path)
+
+
+def _prune(stage):
+    keep = settings.PROJECTION_ARTIFACTS_KEEP
+    latest = latest_version(stage)
+    versions = sorted(
+        (p for p in _root(stage).iterdir() if p.is_dir()), key=lambda p: p.name, reverse=True,
+    )
+    for path in versions[keep:]:
+        if path.name != latest:
+            shutil.rmtree(path, ignore_errors=True)
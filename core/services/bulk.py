@@ -0,0 +1,70 @@
+"""
+COPY-based bulk writes.
+
+Rows are streamed with a binary COPY into a temporary table shaped like the
+target columns, then applied in one set-based INSERT ... ON CONFLICT DO
+UPDATE (copy_upsert). This avoids bulk_update's per-batch CASE WHEN
+statements and any per-row queries.
+"""
+import itertools
+
+from django.db import connection, transaction
+
+_temp_ids = itertools.count()
+
+
+def _column(model, name):
+    return connection.ops.quote_name(model._meta.get_field(name).column)
+
+
+def _copy_to_temp(cursor, model, fields, rows):
+    """COPY rows (tuples aligned with `fields`) into a new temp table; returns its name."""
+    from pgvector.psycopg import register_vector
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    temp = f'bulk_{model._meta.db_table}_{next(_temp_ids)}'
+    columns = ', '.join(_column(model, name) for name in fields)
+
+    cursor.execute(f'CREATE TEMP TABLE {temp} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA')
+    cursor.execute(f'SELECT {columns} FROM {temp} LIMIT 0')
+    type_oids = [col.type_code for col in cursor.description]
+
+    # Vector dumpers are registered on this raw cursor only, so the ORM's
+    # own connection keeps returning vectors the way pgvector.django expects.
+    raw = cursor.cursor
+    register_vector(raw)
+    with raw.copy(f'COPY {temp} ({columns}) FROM STDIN (FORMAT BINARY)') as copy:
+        copy.set_types(type_oids)
+        for row in rows:
+            copy.write_row(row)
+
+    cursor.execute(f'ANALYZE {temp}')
+    return temp
+
+
+def copy_upsert(model, fields, rows, conflict_fields, update_fields=None):
+    """
+    Insert rows, updating existing ones that clash on `conflict_fields`.
+
+    `rows` are tuples aligned with `fields`; on conflict only
+    `update_fields` (default: every field not in `conflict_fields`) are
+    overwritten. Rows must be unique on `conflict_fields`. Returns the
+    number of rows written.
+    """
+    if update_fields is None:
+        update_fields = [name for name in fields if name not in conflict_fields]
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(_column(model, name) for name in fields)
+    conflict = ', '.join(_column(model, name) for name in conflict_fields)
+    assignments = ', '.join(
+        f'{_column(model, name)} = EXCLUDED.{_column(model, name)}' for name in update_fields
+    )
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        temp = _copy_to_temp(cursor, model, fields, rows)
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {temp} '
+            f'ON CONFLICT ({conflict}) DO UPDATE SET {assignments}'
+        )
+        return cursor.rowcount
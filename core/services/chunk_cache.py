@@ -0,0 +1,45 @@
+"""
+Persistent cache of chunk embeddings, shared by every embedding run.
+
+Scraped sites repeat a lot of identical text (cookie banners, legal footers,
+parked-domain pages); chunks are keyed on a hash of their normalized text and
+the model and inference backend (cache_model_name) so each distinct chunk
+is encoded once per model.
+"""
+import hashlib
+
+import numpy as np
+
+from .embeddings import cache_model_name
+
+
+def chunk_key(chunk):
+    """MD5 of the chunk with whitespace collapsed and Unicode NFKC-normalized."""
+    import unicodedata
+    normalized = ' '.join(unicodedata.normalize('NFKC', chunk).split())
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()
+
+
+def lookup(keys):
+    """Return {key: vector} for the keys already cached for the current model and backend."""
+    from core.models import ChunkEmbedding
+
+    rows = ChunkEmbedding.objects.filter(
+        model_name=cache_model_name(), text_hash__in=keys,
+    ).values_list('text_hash', 'vector')
+    return {key: np.asarray(vector, dtype=np.float32) for key, vector in rows}
+
+
+def store(keys, vectors):
+    """Cache newly encoded chunk vectors; concurrent writers of the same chunk are ignored."""
+    from core.models import ChunkEmbedding
+
+    model_name = cache_model_name()
+    ChunkEmbedding.objects.bulk_create(
+        [
+            ChunkEmbedding(text_hash=key, model_name=model_name, vector=vector.tolist())
+            for key, vector in zip(keys, vectors)
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
@@ -1,70 +1,421 @@
+from pathlib import Path
+
 import numpy as np
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+SBERT_BACKENDS = ('torch', 'onnx', 'onnx-int8')
 
 _model = None
 
 
+def _onnx_int8_file():
+    return f'onnx/model_qint8_{settings.SBERT_ONNX_QUANTIZATION}.onnx'
+
+
+def _onnx_model_kwargs():
+    kwargs = {}
+    if settings.SBERT_NUM_THREADS:
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = settings.SBERT_NUM_THREADS
+        kwargs['session_options'] = options
+    return kwargs
+
+
+def load_model(backend=None):
+    """
+    Load the SBERT model with the given inference backend (default SBERT_BACKEND).
+
+    'torch' is the fp32 PyTorch model, 'onnx' runs the same weights on ONNX
+    Runtime and 'onnx-int8' a dynamically int8-quantized ONNX export. The
+    quantized file is taken from SBERT_ONNX_DIR when it was exported locally
+    with `manage.py export_sbert_onnx`, otherwise from the model hub.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or settings.SBERT_BACKEND
+    if backend == 'torch':
+        if settings.SBERT_NUM_THREADS:
+            import torch
+            torch.set_num_threads(settings.SBERT_NUM_THREADS)
+        return SentenceTransformer(settings.SBERT_MODEL_NAME)
+    if backend == 'onnx':
+        return SentenceTransformer(
+            settings.SBERT_MODEL_NAME, backend='onnx', model_kwargs=_onnx_model_kwargs(),
+        )
+    if backend == 'onnx-int8':
+        file_name = _onnx_int8_file()
+        local_dir = Path(settings.SBERT_ONNX_DIR)
+        source = str(local_dir) if (local_dir / file_name).exists() else settings.SBERT_MODEL_NAME
+        return SentenceTransformer(
+            source, backend='onnx', model_kwargs={'file_name': file_name, **_onnx_model_kwargs()},
+        )
+    raise ImproperlyConfigured(
+        f'Unknown SBERT_BACKEND {backend!r}, expected one of {", ".join(SBERT_BACKENDS)}'
+    )
+
+
+def cache_model_name():
+    """
+    Model name the chunk and query caches key vectors on: SBERT_MODEL_NAME,
+    plus SBERT_BACKEND unless it is the fp32 torch one, so vectors of
+    different backends (e.g. int8-quantized ones) never mix.
+    """
+    if settings.SBERT_BACKEND == 'torch':
+        return settings.SBERT_MODEL_NAME
+    return f'{settings.SBERT_MODEL_NAME}:{settings.SBERT_BACKEND}'
+
+
+def export_onnx_model(output_dir=None):
+    """Export the model to ONNX plus a dynamically int8-quantized variant. Returns the directory."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    output_dir = str(output_dir or settings.SBERT_ONNX_DIR)
+    model = SentenceTransformer(settings.SBERT_MODEL_NAME, backend='onnx')
+    model.save_pretrained(output_dir)
+    export_dynamic_quantized_onnx_model(
+        model, settings.SBERT_ONNX_QUANTIZATION, output_dir,
+    )
+    return output_dir
+
+
 def _get_model():
+    """Return this process's model, loading it on first use."""
     global _model
     if _model is None:
-        from sentence_transformers import SentenceTransformer
-        _model = SentenceTransformer(settings.SBERT_MODEL_NAME)
+        _model = load_model()
     return _model
 
 
-def chunk_text(text, chunk_size=500, overlap=100):
-    """Split text into overlapping chunks of ~chunk_size characters."""
-    if len(text) <= chunk_size:
-        return [text]
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
-
-
-def embed_text(text):
-    """Embed a single text, chunking and mean-pooling if needed. Returns np.ndarray(384,)."""
-    model = _get_model()
-    chunks = chunk_text(text)
-    embeddings = model.encode(chunks, show_progress_bar=False)
-    return embeddings.mean(axis=0)
-
-
-def embed_texts_batch(texts, batch_size=256):
-    """Embed multiple texts. Returns np.ndarray(n, 384)."""
-    model = _get_model()
-    all_vectors = []
-    for text in texts:
-        chunks = chunk_text(text)
-        chunk_embeddings = model.encode(chunks, show_progress_bar=False)
-        all_vectors.append(chunk_embeddings.mean(axis=0))
-    return np.array(all_vectors)
-
-
-def compute_umap_projection(vectors):
-    """Reduce vectors to 2D with UMAP. Returns np.ndarray(n, 2)."""
+WARMUP_TEXTS = [
+    'Sviluppo software e consulenza informatica per le imprese.',
+    'Logistics, warehousing and freight transport services across Europe.',
+]
+
+
+def preload_model():
+    """
+    Load the model weights without running inference.
+
+    Safe to call in a preforking parent (gunicorn --preload, the Celery main
+    process): the children share the weights copy-on-write, and no inference
+    thread pool exists yet that a fork could leave in a broken state.
+    """
+    return _get_model()
+
+
+def warmup_model():
+    """Run a throwaway encode so the first real request skips the first-inference cost."""
+    _get_model().encode(WARMUP_TEXTS, show_progress_bar=False)
+
+
+def _select_windows(starts, max_chunks):
+    """Keep the head of the page plus evenly sampled windows from the rest (no cap if falsy)."""
+    if not max_chunks or len(starts) <= max_chunks:
+        return starts
+    head = max_chunks // 2
+    rest = starts[head:]
+    picked = np.linspace(0, len(rest) - 1, max_chunks - head).round().astype(int)
+    return starts[:head] + [rest[i] for i in picked]
+
+
+def chunk_texts(texts, model=None, overlap=None, max_chunks=None, stats=None):
+    """
+    Split texts into chunks on token boundaries. Returns a list of chunk lists.
+
+    Each chunk holds up to the model's max_seq_length tokens (minus special
+    tokens) and overlaps the previous one by `overlap` tokens. Pages longer
+    than `max_chunks` windows (0 = no cap) keep their head plus evenly
+    sampled windows from the rest. Every text gets at least one chunk. If a
+    `stats` dict is given, 'tokens', 'chunks' and 'skipped_tokens' (tokens
+    in no kept chunk) are added to it.
+    """
+    model = model or _get_model()
+    tokenizer = model.tokenizer
+    overlap = settings.SBERT_CHUNK_OVERLAP_TOKENS if overlap is None else overlap
+    max_chunks = settings.SBERT_MAX_CHUNKS if max_chunks is None else max_chunks
+    window = model.max_seq_length - tokenizer.num_special_tokens_to_add()
+    if not 0 <= overlap < window:
+        raise ValueError(
+            f'Chunk overlap must be at least 0 and below the {window}-token window, got {overlap}'
+        )
+    stride = window - overlap
+
+    encodings = tokenizer(
+        list(texts), add_special_tokens=False, return_offsets_mapping=True, verbose=False,
+    )
+
+    result = []
+    total_tokens = total_chunks = skipped = 0
+    for text, offsets in zip(texts, encodings['offset_mapping']):
+        n_tokens = len(offsets)
+        total_tokens += n_tokens
+        if n_tokens <= window:
+            result.append([text])
+            total_chunks += 1
+            continue
+
+        starts = _select_windows(list(range(0, n_tokens - overlap, stride)), max_chunks)
+        chunks = []
+        covered = 0
+        covered_until = 0
+        for start in starts:
+            end = min(start + window, n_tokens)
+            chunks.append(text[offsets[start][0]:offsets[end - 1][1]])
+            covered += end - max(start, covered_until)
+            covered_until = end
+        result.append(chunks)
+        total_chunks += len(chunks)
+        skipped += n_tokens - covered
+
+    if stats is not None:
+        stats['tokens'] = stats.get('tokens', 0) + total_tokens
+        stats['chunks'] = stats.get('chunks', 0) + total_chunks
+        stats['skipped_tokens'] = stats.get('skipped_tokens', 0) + skipped
+    return result
+
+
+def _encode_cached(chunks, model, batch_size, stats=None):
+    """Encode chunks, reusing cached vectors and encoding each distinct miss once."""
+    from . import chunk_cache
+
+    keys = [chunk_cache.chunk_key(chunk) for chunk in chunks]
+    unique = dict(zip(keys, chunks))
+    cached = chunk_cache.lookup(list(unique))
+
+    missing = [key for key in unique if key not in cached]
+    if missing:
+        vectors = model.encode(
+            [unique[key] for key in missing], batch_size=batch_size, show_progress_bar=False,
+        )
+        chunk_cache.store(missing, vectors)
+        cached.update(zip(missing, vectors))
+
+    if stats is not None:
+        stats['encoded_chunks'] = stats.get('encoded_chunks', 0) + len(missing)
+    return np.stack([cached[key] for key in keys])
+
+
+def embed_texts_batch(texts, batch_size=256, model=None, stats=None, cache=None):
+    """
+    Embed multiple texts. Returns np.ndarray(n, 384).
+
+    The chunks of all texts are flattened into a single stream so the model
+    always sees full batches, then mean-pooled back per text via offsets.
+    `model` overrides the process-wide model, e.g. to compare backends;
+    `stats` collects chunking counters (see chunk_texts). With `cache`
+    (default SBERT_CHUNK_CACHE) chunks already in the persistent chunk cache
+    are not sent to the model.
+    """
+    if not texts:
+        return np.empty((0, settings.SBERT_VECTOR_DIMENSIONS), dtype=np.float32)
+
+    model = model or _get_model()
+    chunks_per_text = chunk_texts(texts, model=model, stats=stats)
+
+    counts = np.array([len(chunks) for chunks in chunks_per_text])
+    offsets = np.concatenate(([0], np.cumsum(counts[:-1])))
+    flat_chunks = [chunk for chunks in chunks_per_text for chunk in chunks]
+
+    # SentenceTransformer.encode sorts its input by length before batching,
+    # so one call over the whole stream keeps padding per batch minimal.
+    if settings.SBERT_CHUNK_CACHE if cache is None else cache:
+        chunk_embeddings = _encode_cached(flat_chunks, model, batch_size, stats)
+    else:
+        chunk_embeddings = model.encode(flat_chunks, batch_size=batch_size, show_progress_bar=False)
+
+    sums = np.add.reduceat(chunk_embeddings, offsets, axis=0)
+    return sums / counts[:, None].astype(sums.dtype)
+
+
+def fit_umap_projection(vectors, deterministic=True, n_components=2, n_neighbors=15, min_dist=0.1):
+    """
+    Fit UMAP on vectors. Returns (reducer, np.ndarray(n, n_components)).
+
+    A deterministic fit uses a fixed seed, which forces UMAP to run
+    single-threaded; otherwise it runs with UMAP_N_JOBS threads.
+    """
     import umap
-    n_neighbors = min(15, len(vectors) - 1)
+    n_neighbors = min(n_neighbors, len(vectors) - 1)
     reducer = umap.UMAP(
-        n_components=2,
+        n_components=n_components,
         n_neighbors=max(2, n_neighbors),
-        min_dist=0.1,
+        min_dist=min_dist,
         metric='cosine',
-        random_state=42,
+        random_state=42 if deterministic else None,
+        n_jobs=1 if deterministic else settings.UMAP_N_JOBS,
     )
-    return reducer.fit_transform(vectors)
+    return reducer, reducer.fit_transform(vectors)
+
+
+def stratified_sample(strata, size, seed=42):
+    """
+    Pick `size` indices with every stratum represented in proportion to its
+    share (at least one point each). Returns sorted np.ndarray of indices.
+    """
+    strata = np.asarray(strata)
+    n = len(strata)
+    if size >= n:
+        return np.arange(n)
+
+    rng = np.random.default_rng(seed)
+    _values, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    quotas = np.maximum(1, (counts * size) // n)
+
+    # Shuffle, then group by stratum: the head of each group is a random pick
+    order = rng.permutation(n)
+    order = order[np.argsort(inverse[order], kind='stable')]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    picked = np.concatenate([order[start:start + quota] for start, quota in zip(starts, quotas)])
+
+    if len(picked) > size:
+        picked = rng.choice(picked, size, replace=False)
+    return np.sort(picked)
 
 
-def compute_hdbscan_clusters(vectors):
-    """Cluster vectors with HDBSCAN. Returns np.ndarray(n,) of labels (-1 = noise)."""
+def parallel_backend():
+    """
+    joblib backend for fanning CPU-bound work out: worker processes ('loky'),
+    or threads in a daemonic process such as a Celery prefork child, which
+    may not start processes of its own (joblib would run everything on one
+    core). Threads only help where the work releases the GIL, so route the
+    projection tasks to a non-daemon worker (see PROJECTION_QUEUE).
+    """
+    import multiprocessing
+
+    return 'threading' if multiprocessing.current_process().daemon else 'loky'
+
+
+def fit_landmark_umap(vectors, strata=None, deterministic=None, **umap_kwargs):
+    """
+    Fit UMAP on a stratified sample of UMAP_LANDMARKS landmark vectors, then
+    place the remaining vectors with transform() in parallel workers (see
+    parallel_backend()).
+    Returns (reducer, np.ndarray(n, n_components)). Small corpora are fitted
+    directly. Extra keyword arguments are passed to fit_umap_projection().
+    """
+    from joblib import Parallel, delayed
+
+    deterministic = settings.UMAP_DETERMINISTIC if deterministic is None else deterministic
+    n = len(vectors)
+    if not settings.UMAP_LANDMARKS or n <= settings.UMAP_LANDMARKS:
+        return fit_umap_projection(vectors, deterministic=deterministic, **umap_kwargs)
+
+    strata = np.zeros(n, dtype=np.int8) if strata is None else strata
+    landmarks = stratified_sample(strata, settings.UMAP_LANDMARKS)
+    reducer, landmark_coords = fit_umap_projection(
+        vectors[landmarks], deterministic=deterministic, **umap_kwargs,
+    )
+
+    coords = np.empty((n, landmark_coords.shape[1]), dtype=np.float32)
+    coords[landmarks] = landmark_coords
+
+    rest = np.setdiff1d(np.arange(n), landmarks, assume_unique=True)
+    chunks = [c for c in np.array_split(rest, max(1, settings.UMAP_TRANSFORM_WORKERS)) if len(c)]
+    results = Parallel(n_jobs=settings.UMAP_TRANSFORM_WORKERS, backend=parallel_backend())(
+        delayed(transform_umap_projection)(reducer, vectors[chunk]) for chunk in chunks
+    )
+    for chunk, chunk_coords in zip(chunks, results):
+        coords[chunk] = chunk_coords
+    return reducer, coords
+
+
+def transform_umap_projection(reducer, vectors):
+    """Project new vectors with an already fitted reducer. Returns np.ndarray(n, 2)."""
+    return reducer.transform(vectors)
+
+
+def fit_cluster_space(vectors, strata=None, deterministic=None):
+    """
+    Reduce vectors to the CLUSTER_UMAP_COMPONENTS-d space HDBSCAN runs in.
+
+    Unlike the 2-D display projection it keeps enough dimensions to preserve
+    density structure and packs neighbours tightly (min_dist=0).
+    Returns (reducer, np.ndarray(n, CLUSTER_UMAP_COMPONENTS)).
+    """
+    return fit_landmark_umap(
+        vectors,
+        strata,
+        deterministic=deterministic,
+        n_components=settings.CLUSTER_UMAP_COMPONENTS,
+        n_neighbors=settings.CLUSTER_UMAP_NEIGHBORS,
+        min_dist=0.0,
+    )
+
+
+def cluster_size_params(n):
+    """
+    HDBSCAN (min_cluster_size, min_samples) for a corpus of `n` points: the
+    minimum cluster size grows with the corpus (CLUSTER_MIN_SIZE_FRACTION),
+    never below CLUSTER_MIN_SIZE.
+    """
+    min_cluster_size = max(settings.CLUSTER_MIN_SIZE, int(n * settings.CLUSTER_MIN_SIZE_FRACTION))
+    min_cluster_size = max(2, min(min_cluster_size, n))
+    min_samples = settings.CLUSTER_MIN_SAMPLES or max(3, min_cluster_size // 4)
+    return min_cluster_size, min(min_samples, min_cluster_size)
+
+
+def fit_hdbscan_clusters(vectors):
+    """
+    Cluster vectors with HDBSCAN, keeping prediction data for new points.
+
+    Uses the Boruvka KD-tree algorithm with core distances computed on
+    HDBSCAN_N_JOBS cores and cluster sizes scaled by cluster_size_params().
+    Returns (clusterer, np.ndarray(n,) of labels (-1 = noise)).
+    """
     import hdbscan
+    from joblib import parallel_config
+    min_cluster_size, min_samples = cluster_size_params(len(vectors))
     clusterer = hdbscan.HDBSCAN(
-        min_cluster_size=5,
-        min_samples=3,
+        min_cluster_size=min_cluster_size,
+        min_samples=min_samples,
         metric='euclidean',
+        algorithm='boruvka_kdtree',
+        core_dist_n_jobs=settings.HDBSCAN_N_JOBS,
+        prediction_data=True,
     )
-    clusterer.fit(vectors)
-    return clusterer.labels_
+    # The KD-tree queries release the GIL, so threads still scale where
+    # worker processes can't be started
+    with parallel_config(backend=parallel_backend()):
+        clusterer.fit(vectors)
+    return clusterer, clusterer.labels_
+
+
+def predict_hdbscan_clusters(clusterer, vectors):
+    """Assign new points to the clusters of a fitted clusterer. Returns np.ndarray(n,) of labels."""
+    import hdbscan
+    labels, _strengths = hdbscan.approximate_predict(clusterer, vectors)
+    return labels
+
+
+def align_cluster_ids(labels, previous):
+    """
+    Renumber fresh cluster labels to reuse the previous run's ids.
+
+    Each new cluster takes the previous id most of its members had, largest
+    overlaps first and each id at most once; unmatched clusters get ids above
+    the previous maximum. `previous` holds the old id per point (-1 if none).
+    Returns (aligned labels, {new label: aligned id}).
+    """
+    from collections import Counter
+
+    labels = np.asarray(labels)
+    previous = np.asarray(previous)
+    clustered = (labels >= 0) & (previous >= 0)
+    overlaps = Counter(zip(labels[clustered].tolist(), previous[clustered].tolist()))
+
+    mapping = {}
+    taken = set()
+    for (new, old), _count in overlaps.most_common():
+        if new not in mapping and old not in taken:
+            mapping[new] = old
+            taken.add(old)
+
+    next_id = int(previous.max()) + 1 if len(previous) else 0
+    for new in sorted(set(labels.tolist()) - {-1} - set(mapping)):
+        mapping[new] = max(next_id, 0)
+        next_id = mapping[new] + 1
+    mapping[-1] = -1
+
+    return np.array([mapping[label] for label in labels.tolist()], dtype=np.int64), mapping
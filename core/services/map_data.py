@@ -0,0 +1,158 @@
+"""
+Columnar binary encoding of the map data served by /api/map-data/.
+
+The payload is a small JSON header followed by raw little-endian arrays,
+one per column, so the browser can wrap them in typed arrays without
+parsing:
+
+    b'B2VM'      magic
+    uint32       byte length of the JSON header
+    header       UTF-8 JSON: {"version", "run", "count", "columns", "dictionaries"}
+    padding      up to a multiple of 8 bytes
+    body         the columns; each header column entry gives its "name",
+                 "dtype" (int32, uint32, float32, uint16 or uint8), "offset"
+                 into the body (8-byte aligned) and "length" in elements
+
+Industry and cluster label are dictionary-encoded: the column holds indexes
+into header["dictionaries"][name]. Company names are a separate payload
+(build_names_payload) so the map can draw before they arrive: UTF-8 bytes
+("name_bytes") plus count + 1 uint32 offsets into them ("name_offsets").
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'B2VM'
+FORMAT_VERSION = 1
+CONTENT_TYPE = 'application/vnd.b2vec.map-columns'
+
+_ALIGN = 8
+
+
+def _pad(length):
+    return -length % _ALIGN
+
+
+def _dictionary_encode(values):
+    """Returns (sorted distinct values, np.ndarray of their indexes)."""
+    uniques, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    dtype = np.uint16 if len(uniques) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    return uniques.tolist(), codes.astype(dtype)
+
+
+def _utf8_column(values):
+    """Returns (uint32 offsets of length n + 1, uint8 UTF-8 bytes) for a list of strings."""
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def encode_columns(run_id, count, columns, dictionaries):
+    """Serialize {name: np.ndarray} columns into the binary map format."""
+    entries = []
+    chunks = []
+    offset = 0
+    for name, array in columns.items():
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        data = array.tobytes()
+        entries.append({
+            'name': name,
+            'dtype': array.dtype.name,
+            'offset': offset,
+            'length': len(array),
+        })
+        chunks += [data, b'\0' * _pad(len(data))]
+        offset += len(data) + _pad(len(data))
+
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'run': run_id,
+        'count': count,
+        'columns': entries,
+        'dictionaries': dictionaries,
+    }, separators=(',', ':')).encode()
+    prefix = MAGIC + struct.pack('<I', len(header)) + header
+    return b''.join([prefix, b'\0' * _pad(len(prefix)), *chunks])
+
+
+def _rows(run, fields):
+    """values_list rows of the run's placed points, ordered by company id."""
+    if run is None:
+        return []
+    return list(
+        run.points
+        .filter(umap_x__isnull=False)
+        .order_by('company_id')
+        .values_list(*fields)
+    )
+
+
+def build_json_payload(run):
+    """The run's points as the JSON document of /api/map-data/."""
+    from django.core.serializers.json import DjangoJSONEncoder
+
+    rows = _rows(run, [
+        'company_id', 'company__name', 'company__url', 'umap_x', 'umap_y',
+        'company__industry', 'cluster_id', 'cluster_label',
+    ])
+    companies = [
+        {
+            'id': row[0],
+            'name': row[1],
+            'url': row[2],
+            'x': row[3],
+            'y': row[4],
+            'industry': row[5] or 'Unknown',
+            'cluster_id': row[6],
+            'cluster_label': row[7] or 'Unknown',
+        }
+        for row in rows
+    ]
+    return json.dumps({'companies': companies}, cls=DjangoJSONEncoder).encode()
+
+
+def build_map_payload(run):
+    """
+    Encode the points of a projection run, ordered by company id, without
+    names (see build_names_payload).
+    """
+    rows = _rows(run, [
+        'company_id', 'umap_x', 'umap_y', 'cluster_id', 'company__industry', 'cluster_label',
+    ])
+    ids, xs, ys, cluster_ids, industries, labels = zip(*rows) if rows else ([],) * 6
+
+    industry_values, industry_codes = _dictionary_encode([value or 'Unknown' for value in industries])
+    label_values, label_codes = _dictionary_encode([value or 'Unknown' for value in labels])
+
+    columns = {
+        'id': np.array(ids, dtype=np.uint32),
+        'x': np.array(xs, dtype=np.float32),
+        'y': np.array(ys, dtype=np.float32),
+        'cluster_id': np.array([-1 if cid is None else cid for cid in cluster_ids], dtype=np.int32),
+        'industry': industry_codes,
+        'cluster_label': label_codes,
+    }
+    return encode_columns(
+        run.pk if run else None, len(rows), columns,
+        {'industry': industry_values, 'cluster_label': label_values},
+    )
+
+
+def build_names_payload(run):
+    """
+    Encode the company names of a run in the same order as
+    build_map_payload(); clients match the two by the header's run id.
+    """
+    rows = _rows(run, ['company__name'])
+    offsets, data = _utf8_column([row[0] for row in rows])
+    return encode_columns(run.pk if run else None, len(rows), {'name_offsets': offsets, 'name_bytes': data}, {})
+
+
+# Variant of /api/map-data/ -> (builder, content type)
+VARIANTS = {
+    'json': (build_json_payload, 'application/json'),
+    'binary': (build_map_payload, CONTENT_TYPE),
+    'names': (build_names_payload, CONTENT_TYPE),
+}
@@ -0,0 +1,112 @@
+"""
+Precompressed /api/map-data/ snapshots.
+
+The map only changes when a projection run is activated, so each variant of
+the payload (see map_data.VARIANTS) is rendered once per run and written
+to MAP_SNAPSHOT_DIR as <run>.<variant>.gz (and .br when the optional
+`brotli` package is installed). compute_projections_task renders them before
+activating the run. A request that finds a snapshot missing (a cold cache, a
+rollback to an older run) builds it under a single-flight lock: a thread
+lock within the process plus a file lock across processes, so concurrent
+misses wait for one build instead of all querying Postgres.
+"""
+import fcntl
+import gzip
+import logging
+import os
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+from core.services.map_data import VARIANTS
+
+logger = logging.getLogger(__name__)
+
+ENCODINGS = ('br', 'gzip')
+_SUFFIXES = {'br': 'br', 'gzip': 'gz'}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _root():
+    return Path(settings.MAP_SNAPSHOT_DIR)
+
+
+def snapshot_path(run_id, variant, encoding='gzip'):
+    return _root() / f'{run_id}.{variant}.{_SUFFIXES[encoding]}'
+
+
+def available_encodings():
+    """Encodings snapshots are written in; brotli only if installed."""
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return ('gzip',)
+    return ENCODINGS
+
+
+def snapshot_encodings(run_id, variant):
+    """
+    Encodings the run's `variant` snapshot exists in. A snapshot rendered by
+    a process without brotli has no .br file, whatever this process has.
+    """
+    return tuple(e for e in ENCODINGS if snapshot_path(run_id, variant, e).exists())
+
+
+def _write(path, data):
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _render(run, variant):
+    builder, _content_type = VARIANTS[variant]
+    payload = builder(run)
+    # gzip is written last: its presence marks the variant as complete
+    if 'br' in available_encodings():
+        import brotli
+        _write(snapshot_path(run.pk, variant, 'br'), brotli.compress(payload, quality=9))
+    _write(snapshot_path(run.pk, variant, 'gzip'), gzip.compress(payload, compresslevel=9))
+
+
+def render_snapshots(run):
+    """Render every payload variant of a projection run."""
+    _root().mkdir(parents=True, exist_ok=True)
+    for variant in VARIANTS:
+        _render(run, variant)
+
+
+def _flight_lock(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def ensure_snapshot(run, variant):
+    """Make sure the run's `variant` snapshot exists, building it at most once at a time."""
+    if snapshot_path(run.pk, variant).exists():
+        return
+
+    with _flight_lock((run.pk, variant)):
+        if snapshot_path(run.pk, variant).exists():
+            return
+        _root().mkdir(parents=True, exist_ok=True)
+        with open(_root() / f'{run.pk}.{variant}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not snapshot_path(run.pk, variant).exists():
+                    logger.info('Building map snapshot %s for run %d', variant, run.pk)
+                    _render(run, variant)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def prune(run_ids):
+    """Delete snapshot files of runs not in `run_ids`."""
+    keep = {str(run_id) for run_id in run_ids}
+    if not _root().exists():
+        return
+    for path in _root().iterdir():
+        if path.name.split('.', 1)[0] not in keep:
+            path.unlink(missing_ok=True)
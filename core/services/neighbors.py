@@ -0,0 +1,175 @@
+"""
+Precomputed nearest neighbours for /api/similar/.
+
+build_neighbors() finds every embedded company's SIMILAR_NEIGHBORS_K nearest
+companies by exact cosine similarity. The vectors are loaded once
+(memory-mapped, see core.services.vectors) and cut into shards of rows that
+NEIGHBORS_WORKERS threads score against the whole corpus with blocked
+float32 matrix products, NEIGHBORS_BLOCK_SIZE x NEIGHBORS_BLOCK_SIZE scores at
+a time. Threads rather than processes: the products release the GIL, share
+the memory-mapped vectors and still run inside a Celery prefork child, where
+no worker processes can be started. Each shard is written to CompanyNeighbors as soon as it is done, so
+memory stays bounded by the shard size.
+
+The similar-companies endpoint then reads one row by primary key
+(precomputed_neighbors) and only falls back to a live vector query for
+companies embedded after the last build.
+"""
+import logging
+import math
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+NEIGHBOR_FIELDS = ['company', 'neighbor_ids', 'distances', 'computed_at']
+
+
+def _inverse_norms(vectors, block):
+    inv = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        norms = np.linalg.norm(vectors[start:start + block], axis=1)
+        inv[start:start + block] = 1.0 / np.maximum(norms, 1e-12)
+    return inv
+
+
+def _shard_neighbors(vectors, inv_norms, start, stop, k, block):
+    """
+    Top-k neighbours of rows [start, stop) against all rows, excluding
+    themselves. Returns (start, row indexes (m, k), cosine distances (m, k)),
+    nearest first.
+    """
+    n = len(vectors)
+    indexes = np.empty((stop - start, k), dtype=np.int64)
+    distances = np.empty((stop - start, k), dtype=np.float32)
+
+    for q0 in range(start, stop, block):
+        q1 = min(q0 + block, stop)
+        queries = vectors[q0:q1] * inv_norms[q0:q1, None]
+        best_sims = np.empty((q1 - q0, 0), dtype=np.float32)
+        best_idx = np.empty((q1 - q0, 0), dtype=np.int64)
+
+        for c0 in range(0, n, block):
+            c1 = min(c0 + block, n)
+            sims = queries @ (vectors[c0:c1] * inv_norms[c0:c1, None]).T
+            own = np.arange(max(q0, c0), min(q1, c1))
+            sims[own - q0, own - c0] = -np.inf
+
+            sims = np.hstack([best_sims, sims])
+            idx = np.hstack([best_idx, np.broadcast_to(np.arange(c0, c1), (q1 - q0, c1 - c0))])
+            if sims.shape[1] > k:
+                keep = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                sims = np.take_along_axis(sims, keep, axis=1)
+                idx = np.take_along_axis(idx, keep, axis=1)
+            best_sims, best_idx = sims, idx
+
+        order = np.argsort(-best_sims, axis=1)
+        indexes[q0 - start:q1 - start] = np.take_along_axis(best_idx, order, axis=1)
+        distances[q0 - start:q1 - start] = 1.0 - np.take_along_axis(best_sims, order, axis=1)
+
+    return start, indexes, distances
+
+
+def build_neighbors(k=None):
+    """
+    Recompute CompanyNeighbors for every embedded company and delete the
+    rows of companies no longer embedded. Returns the number of rows written.
+    """
+    from joblib import Parallel, delayed
+    from threadpoolctl import threadpool_limits
+
+    from core.models import CompanyNeighbors
+    from core.services.bulk import copy_upsert
+    from core.services.vectors import load_vectors
+
+    computed_at = timezone.now()
+    company_ids, vectors = load_vectors()
+    n = len(company_ids)
+    k = min(k or settings.SIMILAR_NEIGHBORS_K, n - 1)
+
+    written = 0
+    if k > 0:
+        block = settings.NEIGHBORS_BLOCK_SIZE
+        workers = max(1, settings.NEIGHBORS_WORKERS)
+        inv_norms = _inverse_norms(vectors, block)
+        # A few shards per worker, each a whole number of blocks
+        shard = max(block, math.ceil(n / (4 * workers) / block) * block)
+
+        # One BLAS thread per worker thread, so they don't oversubscribe the cores
+        with threadpool_limits(1 if workers > 1 else None, user_api='blas'):
+            results = Parallel(n_jobs=workers, backend='threading', return_as='generator')(
+                delayed(_shard_neighbors)(vectors, inv_norms, lo, min(lo + shard, n), k, block)
+                for lo in range(0, n, shard)
+            )
+            for start, indexes, distances in results:
+                rows = (
+                    (int(company_ids[start + i]), company_ids[indexes[i]].tolist(), distances[i].tolist(), computed_at)
+                    for i in range(len(indexes))
+                )
+                written += copy_upsert(CompanyNeighbors, NEIGHBOR_FIELDS, rows, ['company'])
+                logger.info('Computed neighbours of %d/%d companies', written, n)
+
+    CompanyNeighbors.objects.filter(computed_at__lt=computed_at).delete()
+    return written
+
+
+def precomputed_neighbors(target, n):
+    """
+    The n nearest CompanyEmbedding rows of the CompanyEmbedding `target`
+    from the last build, with `company` selected and `distance` set, nearest
+    first. None if the target has no up to date row, the row holds fewer
+    than n neighbours or one of them was deleted since; callers then fall
+    back to a live query.
+    """
+    from core.models import CompanyEmbedding, CompanyNeighbors
+
+    row = CompanyNeighbors.objects.filter(pk=target.company_id).first()
+    if row is None or (target.embedded_at is not None and row.computed_at < target.embedded_at):
+        return None
+
+    neighbor_ids = row.neighbor_ids[:n]
+    # Short rows are complete (a corpus smaller than k); full ones may be cut off
+    if len(neighbor_ids) < n and len(row.neighbor_ids) >= settings.SIMILAR_NEIGHBORS_K:
+        return None
+    embeddings = (
+        CompanyEmbedding.objects.defer('vector').select_related('company')
+        .in_bulk(neighbor_ids, field_name='company_id')
+    )
+    if len(embeddings) < len(neighbor_ids):
+        return None
+
+    results = []
+    for company_id, distance in zip(neighbor_ids, row.distances):
+        emb = embeddings[company_id]
+        emb.distance = distance
+        results.append(emb)
+    return results
+
+
+def precomputed_hits(company_ids, n):
+    """
+    {company_id: [(neighbor_id, distance), ...]} of the first n stored
+    neighbours, for the companies in `company_ids` whose row is up to date
+    and holds enough of them (see precomputed_neighbors).
+    """
+    from django.db.models import F, Q
+
+    from core.models import CompanyNeighbors
+
+    rows = (
+        CompanyNeighbors.objects
+        .filter(pk__in=company_ids, company__embedding__isnull=False)
+        .filter(
+            Q(company__embedding__embedded_at__isnull=True)
+            | Q(computed_at__gte=F('company__embedding__embedded_at'))
+        )
+        .values_list('company_id', 'neighbor_ids', 'distances')
+    )
+    hits = {}
+    for company_id, neighbor_ids, distances in rows:
+        if len(neighbor_ids) < n and len(neighbor_ids) >= settings.SIMILAR_NEIGHBORS_K:
+            continue
+        hits[company_id] = list(zip(neighbor_ids[:n], distances[:n]))
+    return hits
@@ -0,0 +1,108 @@
+"""
+Versioned projection snapshots.
+
+A projection run never updates the map readers are looking at: it writes
+coordinates and clusters as ProjectionPoint rows of a new ProjectionRun and
+publishes it by flipping ProjectionRun.is_active in one transaction, so
+readers switch from the old snapshot to the new one at once. Re-activating
+an older run rolls a bad projection back. Only the newest
+PROJECTION_RUNS_KEEP finished runs (and always the active one) are kept.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import CompanyEmbedding, ProjectionPoint, ProjectionRun
+
+# Runs still 'building' after this long are assumed dead and collected
+STALE_RUN_AGE = timedelta(days=1)
+
+
+def active_run():
+    """The ProjectionRun readers are served from, or None."""
+    return ProjectionRun.objects.filter(is_active=True).first()
+
+
+def active_points():
+    """ProjectionPoint queryset of the active snapshot (empty if there is none)."""
+    return ProjectionPoint.objects.filter(run__is_active=True)
+
+
+def points_for(company_ids):
+    """{company_id: ProjectionPoint} of the active snapshot for the given companies."""
+    return {
+        point.company_id: point
+        for point in active_points().filter(company_id__in=company_ids)
+    }
+
+
+def start_run(previous=None):
+    """
+    Create a 'building' run, seeded with the points of `previous` whose
+    embedding has not changed since `previous` started.
+    """
+    run = ProjectionRun.objects.create()
+    if previous is None:
+        return run
+
+    point = connection.ops.quote_name(ProjectionPoint._meta.db_table)
+    embedding = connection.ops.quote_name(CompanyEmbedding._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {point} (run_id, company_id, umap_x, umap_y, cluster_id, cluster_label) '
+            f'SELECT %s, p.company_id, p.umap_x, p.umap_y, p.cluster_id, p.cluster_label '
+            f'FROM {point} p JOIN {embedding} e ON e.company_id = p.company_id '
+            f'WHERE p.run_id = %s AND (e.embedded_at IS NULL OR e.embedded_at <= %s)',
+            [run.pk, previous.pk, previous.started_at],
+        )
+        run.stats = {'carried_over': cursor.rowcount}
+    return run
+
+
+def finish_run(run, stats=None):
+    """Mark a built run as ready to be activated."""
+    run.status = 'ready'
+    run.finished_at = timezone.now()
+    run.stats = {**run.stats, **(stats or {})}
+    run.save()
+
+
+def fail_run(run):
+    run.status = 'failed'
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'finished_at'])
+
+
+def activate_run(run):
+    """Atomically make `run` the snapshot readers see. Raises ValueError if it is not ready."""
+    if run.status != 'ready':
+        raise ValueError(f'Projection run {run.pk} is {run.status}, not ready')
+
+    with transaction.atomic():
+        # Lock the current pointer so concurrent activations serialize
+        list(ProjectionRun.objects.select_for_update().filter(is_active=True))
+        ProjectionRun.objects.filter(is_active=True).exclude(pk=run.pk).update(is_active=False)
+        ProjectionRun.objects.filter(pk=run.pk).update(is_active=True)
+    run.is_active = True
+
+
+def collect_garbage(keep=None):
+    """
+    Delete failed and dead runs and all but the newest `keep` (default
+    PROJECTION_RUNS_KEEP) finished runs, never the active one. Returns the
+    number of runs deleted.
+    """
+    keep = settings.PROJECTION_RUNS_KEEP if keep is None else keep
+
+    kept = ProjectionRun.objects.filter(status='ready').order_by('-started_at').values_list('pk', flat=True)[:keep]
+    stale = timezone.now() - STALE_RUN_AGE
+    doomed = (
+        ProjectionRun.objects
+        .filter(is_active=False)
+        .exclude(pk__in=list(kept))
+        .exclude(status='building', started_at__gte=stale)
+    )
+    _total, per_model = doomed.delete()
+    return per_model.get(ProjectionRun._meta.label, 0)
@@ -0,0 +1,179 @@
+"""
+Two-level cache for search query embeddings.
+
+Level one is a bounded in-process LRU; level two is the shared
+QUERY_CACHE_ALIAS cache (Redis) so every web worker benefits from queries
+any of them has already encoded. Keys combine the model and inference
+backend (cache_model_name) and the normalized query, and hits never touch
+the model. The async variants used
+by the ASGI views send their misses to the query micro-batcher
+(core.services.query_encoder) instead of encoding them inline.
+"""
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .embeddings import cache_model_name
+
+logger = logging.getLogger(__name__)
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+_stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+
+
+def normalize_query(query):
+    """Unicode-normalize, case-fold and collapse whitespace."""
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+
+def _cache_key(normalized):
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return f'qemb:{cache_model_name()}:{digest}'
+
+
+def _remember(key, vector):
+    with _lock:
+        _lru[key] = vector
+        _lru.move_to_end(key)
+        while len(_lru) > settings.QUERY_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+
+def get_query_embedding(query):
+    """Return the (read-only) float32 embedding of a search query, using the caches."""
+    return get_query_embeddings([query])[0]
+
+
+def _normalized_keys(queries):
+    """(cache key per query, {key: normalized query})."""
+    keys = []
+    normalized = {}
+    for query in queries:
+        text = normalize_query(query)
+        keys.append(_cache_key(text))
+        normalized[keys[-1]] = text
+    return keys, normalized
+
+
+def _local_hits(keys):
+    found = {}
+    with _lock:
+        for key in keys:
+            vector = _lru.get(key)
+            if vector is not None:
+                _lru.move_to_end(key)
+                _stats['l1_hits'] += 1
+                found[key] = vector
+    return found
+
+
+def _shared_hits(cached):
+    """Decode values read from the shared cache and keep them in the LRU."""
+    found = {}
+    for key, value in cached.items():
+        found[key] = np.frombuffer(value, dtype=np.float32)
+        _remember(key, found[key])
+    with _lock:
+        _stats['l2_hits'] += len(found)
+    return found
+
+
+def _encoded(keys, vectors):
+    """Freeze newly encoded vectors and keep them in the LRU."""
+    found = {}
+    for key, vector in zip(keys, vectors):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        found[key] = vector
+        _remember(key, vector)
+    with _lock:
+        _stats['misses'] += len(found)
+    return found
+
+
+def _shared_values(encoded):
+    return {key: vector.tobytes() for key, vector in encoded.items()}
+
+
+def get_query_embeddings(queries):
+    """
+    Return the (read-only) float32 embeddings of several search queries,
+    in order. Cache misses are looked up in the shared cache in one call and
+    the rest encoded in a single model batch.
+    """
+    from .embeddings import embed_texts_batch
+
+    keys, normalized = _normalized_keys(queries)
+    found = _local_hits(normalized)
+
+    shared = caches[settings.QUERY_CACHE_ALIAS]
+    missing = [key for key in normalized if key not in found]
+    if missing:
+        try:
+            found.update(_shared_hits(shared.get_many(missing)))
+        except Exception as exc:
+            logger.warning('Query embedding cache unavailable: %s', exc)
+
+    missing = [key for key in missing if key not in found]
+    if missing:
+        vectors = embed_texts_batch([normalized[key] for key in missing], cache=False)
+        encoded = _encoded(missing, vectors)
+        found.update(encoded)
+        try:
+            shared.set_many(_shared_values(encoded), timeout=settings.QUERY_CACHE_TIMEOUT)
+        except Exception as exc:
+            logger.warning('Query embedding cache unavailable: %s', exc)
+
+    return [found[key] for key in keys]
+
+
+async def aget_query_embedding(query):
+    """Async get_query_embedding(), encoding misses through the query micro-batcher."""
+    return (await aget_query_embeddings([query]))[0]
+
+
+async def aget_query_embeddings(queries):
+    """
+    Async get_query_embeddings(). Misses are encoded by
+    core.services.query_encoder together with those of concurrent requests.
+    """
+    from .query_encoder import encode_queries
+
+    keys, normalized = _normalized_keys(queries)
+    found = _local_hits(normalized)
+
+    shared = caches[settings.QUERY_CACHE_ALIAS]
+    missing = [key for key in normalized if key not in found]
+    if missing:
+        try:
+            found.update(_shared_hits(await shared.aget_many(missing)))
+        except Exception as exc:
+            logger.warning('Query embedding cache unavailable: %s', exc)
+
+    missing = [key for key in missing if key not in found]
+    if missing:
+        vectors = await encode_queries([normalized[key] for key in missing])
+        encoded = _encoded(missing, vectors)
+        found.update(encoded)
+        try:
+            await shared.aset_many(_shared_values(encoded), timeout=settings.QUERY_CACHE_TIMEOUT)
+        except Exception as exc:
+            logger.warning('Query embedding cache unavailable: %s', exc)
+
+    return [found[key] for key in keys]
+
+
+def cache_stats():
+    """Hit/miss counters and LRU size for this process."""
+    with _lock:
+        stats = dict(_stats, l1_size=len(_lru), l1_max_size=settings.QUERY_CACHE_SIZE)
+    lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['l1_hits'] + stats['l2_hits']) / lookups, 4) if lookups else None
+    return stats
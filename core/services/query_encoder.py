@@ -0,0 +1,112 @@
+"""
+Micro-batched search query encoding for async (ASGI) views.
+
+Concurrent callers of encode_queries() on an event loop put their texts on
+that loop's queue. A collector task takes the first waiting text, gathers
+more for up to QUERY_BATCH_MAX_WAIT_MS or until QUERY_BATCH_MAX_SIZE texts,
+and encodes them as one model batch on a dedicated single-thread executor,
+then resolves each caller's future with its vector. Under load, texts queue
+up while a batch is encoding, so the next batch fills without waiting; when
+idle, a lone query waits at most QUERY_BATCH_MAX_WAIT_MS. Encodes never run
+concurrently, so torch threads don't contend across requests.
+"""
+import asyncio
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query-encoder')
+_encoders = weakref.WeakKeyDictionary()  # event loop -> QueryEncoder
+
+
+def _encode(texts):
+    from .embeddings import embed_texts_batch
+
+    return embed_texts_batch(texts, cache=False)
+
+
+class QueryEncoder:
+    """Batches the encodes requested on one event loop."""
+
+    def __init__(self, max_size, max_wait):
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+        self._collector = None
+
+    async def encode(self, texts):
+        """Float32 vectors of `texts`, encoded together with other callers' texts."""
+        if self._collector is None or self._collector.done():
+            self._collector = asyncio.create_task(self._collect())
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._queue.put_nowait((text, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            # Callers may have been cancelled (client gone) while waiting
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            texts = list(dict.fromkeys(text for text, _future in batch))
+            try:
+                vectors = await loop.run_in_executor(_executor, _encode, texts)
+            except Exception as exc:
+                logger.exception('Query batch of %d texts failed', len(texts))
+                # Callers get the error without this task's frames: clearing
+                # them (e.g. traceback.clear_frames) would close the collector
+                exc = exc.with_traceback(None)
+                for _text, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            encoded = dict(zip(texts, vectors))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(encoded[text])
+
+
+def get_encoder():
+    """The QueryEncoder of the running event loop."""
+    loop = asyncio.get_running_loop()
+    encoder = _encoders.get(loop)
+    if encoder is None:
+        encoder = _encoders[loop] = QueryEncoder(
+            settings.QUERY_BATCH_MAX_SIZE, settings.QUERY_BATCH_MAX_WAIT_MS / 1000,
+        )
+    return encoder
+
+
+async def encode_queries(texts):
+    """Encode texts (already normalized queries) through the running loop's batcher."""
+    return await get_encoder().encode(texts)
@@ -0,0 +1,351 @@
+"""
+Nearest-neighbour search over CompanyEmbedding vectors.
+
+VECTOR_SEARCH_INDEX picks the HNSW index used for the candidate search:
+'vector' (full float32, embedding_hnsw_idx), 'halfvec' (float16 expression
+index, about half the memory) or 'bit' (binary-quantized expression index,
+about 1/32). The compact modes fetch VECTOR_RERANK_CANDIDATES candidates from
+their index and re-rank them exactly against the full vectors in the same
+query. Compact indexes are built with `manage.py sync_vector_indexes`.
+
+Searches can be filtered on the columns in FILTER_FIELDS, denormalized from
+Company onto CompanyEmbedding. Filtered searches turn on pgvector's
+iterative index scans (VECTOR_ITERATIVE_SCAN), so the HNSW scan keeps going
+until enough rows pass the filter instead of returning fewer than n.
+sync_vector_indexes also builds partial HNSW indexes for the countries in
+VECTOR_PARTIAL_INDEX_COUNTRIES, which the planner uses for searches
+filtered on those countries.
+
+With VECTOR_SEARCH_BACKEND set to 'numpy' or 'hnswlib', unfiltered searches
+run on the in-process index of core.services.ann and only the resulting rows
+are read from Postgres. Filtered searches, and searches made before an index
+has been published, still go to pgvector.
+"""
+import copy
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Func, Value
+from django.db.models.functions import Cast
+from pgvector import HalfVector
+from pgvector.django import BitField, CosineDistance, HalfVectorField, HammingDistance
+
+SEARCH_MODES = ('vector', 'halfvec', 'bit')
+
+SEARCH_BACKENDS = ('pgvector', 'numpy', 'hnswlib')
+
+# Filterable CompanyEmbedding columns, copied from the Company columns of the same name
+FILTER_FIELDS = ('industry', 'country_code', 'state', 'size')
+
+# Full-precision HNSW index (see CompanyEmbedding.Meta), used for partial indexes.
+# Index definitions are (name, index element): a plain column or a
+# parenthesized expression, followed by the operator class.
+VECTOR_INDEX = ('embedding_hnsw_idx', 'vector vector_cosine_ops')
+
+# Compact index name -> indexed expression and operator class
+COMPACT_INDEXES = {
+    'halfvec': ('embedding_halfvec_hnsw_idx', '(vector::halfvec({dims})) halfvec_cosine_ops'),
+    'bit': ('embedding_bit_hnsw_idx', '(binary_quantize(vector)::bit({dims})) bit_hamming_ops'),
+}
+
+
+def _coarse_distance(mode, vector):
+    """Distance expression matching the compact index for `mode`."""
+    dims = settings.SBERT_VECTOR_DIMENSIONS
+    if mode == 'halfvec':
+        return CosineDistance(
+            Cast('vector', HalfVectorField(dimensions=dims)),
+            Cast(Value(HalfVector(vector).to_text()), HalfVectorField(dimensions=dims)),
+        )
+    bits = ''.join('1' if x > 0 else '0' for x in vector)
+    return HammingDistance(
+        Cast(Func('vector', function='binary_quantize', output_field=BitField()), BitField(length=dims)),
+        Cast(Value(bits), BitField(length=dims)),
+    )
+
+
+def partial_index_name(base, country_code):
+    return f'{base}_{country_code.lower()}'
+
+
+def sync_filter_columns(company_ids=None):
+    """
+    Copy the FILTER_FIELDS of Company onto CompanyEmbedding where they
+    differ, optionally only for `company_ids`. Returns the rows updated.
+    """
+    from core.models import Company, CompanyEmbedding
+
+    embedding = connection.ops.quote_name(CompanyEmbedding._meta.db_table)
+    company = connection.ops.quote_name(Company._meta.db_table)
+    assignments = ', '.join(f'{name} = c.{name}' for name in FILTER_FIELDS)
+    changed = ' OR '.join(f'e.{name} IS DISTINCT FROM c.{name}' for name in FILTER_FIELDS)
+    sql = f'UPDATE {embedding} e SET {assignments} FROM {company} c WHERE c.id = e.company_id AND ({changed})'
+    params = []
+    if company_ids is not None:
+        sql += ' AND e.company_id = ANY(%s)'
+        params.append(list(company_ids))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _set_ef_search(ef_search):
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL hnsw.ef_search = %s', [int(ef_search)])
+
+
+def _set_iterative_scan():
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL hnsw.iterative_scan = %s', [settings.VECTOR_ITERATIVE_SCAN])
+        cursor.execute('SET LOCAL hnsw.max_scan_tuples = %s', [int(settings.VECTOR_MAX_SCAN_TUPLES)])
+
+
+def _search_options(mode, backend, filters):
+    """Validated (mode, backend, filters) with settings defaults and empty filters dropped."""
+    backend = backend or settings.VECTOR_SEARCH_BACKEND
+    if backend not in SEARCH_BACKENDS:
+        raise ImproperlyConfigured(
+            f'Unknown VECTOR_SEARCH_BACKEND {backend!r}, expected one of {", ".join(SEARCH_BACKENDS)}'
+        )
+    mode = mode or settings.VECTOR_SEARCH_INDEX
+    if mode not in SEARCH_MODES:
+        raise ImproperlyConfigured(
+            f'Unknown VECTOR_SEARCH_INDEX {mode!r}, expected one of {", ".join(SEARCH_MODES)}'
+        )
+
+    filters = {name: value for name, value in (filters or {}).items() if value}
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown search filters: {", ".join(sorted(unknown))}')
+    return mode, backend, filters
+
+
+def _ann_embeddings(index, vector, n, exclude_company_id, ef_search):
+    """nearest_embeddings() on an in-process index: only the hits are read from Postgres."""
+    from core.models import CompanyEmbedding
+
+    k = n + (exclude_company_id is not None)
+    company_ids, distances = index.search(vector, k, ef_search)
+    rows = CompanyEmbedding.objects.select_related('company').in_bulk(
+        [int(cid) for cid in company_ids], field_name='company_id',
+    )
+    results = []
+    for company_id, distance in zip(company_ids, distances):
+        # Companies deleted since the index was built are skipped
+        emb = rows.get(int(company_id))
+        if emb is None or emb.company_id == exclude_company_id:
+            continue
+        emb.distance = float(distance)
+        results.append(emb)
+    return results[:n]
+
+
+def nearest_embeddings(
+    vector, n, exclude_company_id=None, mode=None, filters=None, ef_search=None, backend=None,
+):
+    """
+    Return the n CompanyEmbedding rows closest to `vector` by cosine distance.
+
+    Rows come with `company` selected and a `distance` annotation, nearest
+    first. `mode` overrides VECTOR_SEARCH_INDEX and `backend`
+    VECTOR_SEARCH_BACKEND. `filters` maps FILTER_FIELDS to required values
+    and turns on iterative index scans; `ef_search` overrides the HNSW
+    candidate list size for this query.
+    """
+    from core.models import CompanyEmbedding
+    from core.services.ann import get_index
+
+    mode, backend, filters = _search_options(mode, backend, filters)
+    vector = [float(x) for x in vector]
+
+    if backend != 'pgvector' and not filters:
+        index = get_index(backend)
+        if index is not None:
+            return _ann_embeddings(index, vector, n, exclude_company_id, ef_search)
+
+    qs = CompanyEmbedding.objects.filter(**filters)
+    if exclude_company_id is not None:
+        qs = qs.exclude(company_id=exclude_company_id)
+
+    exact = CosineDistance('vector', vector)
+    if mode == 'vector':
+        k = n
+        results = qs.annotate(distance=exact).order_by('distance').select_related('company')[:n]
+    else:
+        k = max(settings.VECTOR_RERANK_CANDIDATES, n)
+        candidates = qs.order_by(_coarse_distance(mode, vector)).values('pk')[:k]
+        results = (
+            CompanyEmbedding.objects.filter(pk__in=candidates)
+            .annotate(distance=exact)
+            .order_by('distance')
+            .select_related('company')[:n]
+        )
+
+    if mode == 'vector' and not filters and ef_search is None:
+        return list(results)
+
+    with transaction.atomic():
+        # ef_search bounds how many rows an HNSW scan can return
+        _set_ef_search(max(k, ef_search or 40))
+        if filters:
+            _set_iterative_scan()
+        results = list(results)
+    # relaxed_order scans may return rows slightly out of order
+    return sorted(results, key=lambda emb: emb.distance)
+
+
+# Batch search: one LATERAL subquery per query row, so every query is
+# answered by its own HNSW index scan within a single statement. `source`
+# yields (vec, exclude_id, ord) rows; a query without hits still yields one
+# row with a NULL company_id.
+BATCH_SQL = """
+SELECT q.ord, nn.company_id, nn.distance
+FROM {source}
+LEFT JOIN LATERAL (
+    SELECT c.company_id, c.vector <=> q.vec AS distance
+    FROM (
+        SELECT e.company_id, e.vector FROM {embedding} e
+        WHERE e.company_id IS DISTINCT FROM q.exclude_id{filters}
+        ORDER BY {coarse}
+        LIMIT %(candidates)s
+    ) c
+    ORDER BY distance
+    LIMIT %(n)s
+) nn ON true
+ORDER BY q.ord, nn.distance
+"""
+
+VECTORS_SOURCE = """(
+    SELECT u.vec, NULL::bigint AS exclude_id, u.ord
+    FROM unnest(%(vectors)s::vector[]) WITH ORDINALITY AS u(vec, ord)
+) q"""
+
+COMPANIES_SOURCE = """(
+    SELECT t.vector AS vec, t.company_id AS exclude_id, u.ord
+    FROM unnest(%(company_ids)s::bigint[]) WITH ORDINALITY AS u(company_id, ord)
+    JOIN {embedding} t ON t.company_id = u.company_id
+) q"""
+
+# Candidate ordering of each mode, matching its HNSW index
+BATCH_COARSE = {
+    'vector': 'e.vector <=> q.vec',
+    'halfvec': '(e.vector::halfvec({dims})) <=> (q.vec::halfvec({dims}))',
+    'bit': '(binary_quantize(e.vector)::bit({dims})) <~> (binary_quantize(q.vec)::bit({dims}))',
+}
+
+
+def _batch_hits(source, params, n, mode, filters, ef_search):
+    """Run BATCH_SQL; returns {ord: [(company_id, distance), ...]} for the query rows found."""
+    from core.models import CompanyEmbedding
+
+    embedding = connection.ops.quote_name(CompanyEmbedding._meta.db_table)
+    k = n if mode == 'vector' else max(settings.VECTOR_RERANK_CANDIDATES, n)
+    sql = BATCH_SQL.format(
+        source=source.format(embedding=embedding),
+        embedding=embedding,
+        filters=''.join(f' AND e.{name} = %(filter_{name})s' for name in filters),
+        coarse=BATCH_COARSE[mode].format(dims=settings.SBERT_VECTOR_DIMENSIONS),
+    )
+    params = {
+        **params,
+        **{f'filter_{name}': value for name, value in filters.items()},
+        'candidates': k,
+        'n': n,
+    }
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # +1: the scan also meets the excluded target itself
+        _set_ef_search(max(k + 1, ef_search or 40))
+        if filters:
+            _set_iterative_scan()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    hits = {}
+    for ord_, company_id, distance in rows:
+        found = hits.setdefault(ord_ - 1, [])
+        if company_id is not None:
+            found.append((company_id, distance))
+    return hits
+
+
+def _load_hits(hits):
+    """CompanyEmbedding rows for lists of (company_id, distance) hits, read in one query."""
+    from core.models import CompanyEmbedding
+
+    company_ids = {company_id for found in hits if found for company_id, _distance in found}
+    rows = (
+        CompanyEmbedding.objects.defer('vector').select_related('company')
+        .in_bulk(company_ids, field_name='company_id')
+    )
+    results = []
+    for found in hits:
+        if found is None:
+            results.append(None)
+            continue
+        embeddings = []
+        for company_id, distance in found:
+            if company_id in rows:
+                # The same company can be a hit of several queries
+                emb = copy.copy(rows[company_id])
+                emb.distance = float(distance)
+                embeddings.append(emb)
+        results.append(embeddings)
+    return results
+
+
+def nearest_embeddings_batch(vectors, n, mode=None, filters=None, ef_search=None, backend=None):
+    """
+    nearest_embeddings() for several query vectors at once: one list of
+    rows per vector, in order. With pgvector all queries are answered by a
+    single statement (BATCH_SQL); with an in-process index (unfiltered
+    searches only) they are searched in memory. Either way the rows are
+    then read in one query.
+    """
+    from pgvector import Vector
+
+    from core.services.ann import get_index
+
+    mode, backend, filters = _search_options(mode, backend, filters)
+    if not len(vectors):
+        return []
+
+    index = get_index(backend) if backend != 'pgvector' and not filters else None
+    if index is not None:
+        hits = []
+        for vector in vectors:
+            company_ids, distances = index.search(vector, n, ef_search)
+            hits.append(list(zip(company_ids.tolist(), distances.tolist())))
+    else:
+        literal = '{%s}' % ','.join(f'"{Vector(vector).to_text()}"' for vector in vectors)
+        found = _batch_hits(VECTORS_SOURCE, {'vectors': literal}, n, mode, filters, ef_search)
+        hits = [found.get(i, []) for i in range(len(vectors))]
+    return _load_hits(hits)
+
+
+def similar_embeddings_batch(company_ids, n, mode=None, filters=None, ef_search=None):
+    """
+    The n nearest CompanyEmbedding rows of each company in `company_ids`,
+    excluding the company itself; None for companies without an embedding.
+    Unfiltered requests are answered from the precomputed neighbour table
+    where it is up to date; the rest run as one pgvector statement over the
+    stored vectors (BATCH_SQL).
+    """
+    from core.services.neighbors import precomputed_hits
+
+    mode, _backend, filters = _search_options(mode, None, filters)
+    if not company_ids:
+        return []
+
+    by_company = {}
+    if not filters and ef_search is None:
+        by_company = precomputed_hits(company_ids, n)
+
+    remaining = sorted({cid for cid in company_ids if cid not in by_company})
+    if remaining:
+        found = _batch_hits(COMPANIES_SOURCE, {'company_ids': remaining}, n, mode, filters, ef_search)
+        by_company.update((remaining[i], hits) for i, hits in found.items())
+
+    return _load_hits([by_company.get(company_id) for company_id in company_ids])
@@ -0,0 +1,150 @@
+"""
+Viewport / level-of-detail queries over a projection run.
+
+Zoom level z splits the run's bounding box into 2**z x 2**z tiles. Below
+MAP_TILE_DETAIL_ZOOM the map is served from ProjectionCell summaries: each
+tile is a MAP_TILE_BINS x MAP_TILE_BINS grid of cells holding the point
+count, centroid and most common cluster, pre-aggregated once per run by
+build_cells(). From MAP_TILE_DETAIL_ZOOM on, the individual points inside
+the requested bounding box are returned, found through the GiST index on
+point(umap_x, umap_y).
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+
+from core.models import Company, ProjectionCell, ProjectionPoint
+
+# First key of the advisory lock cell builders take (the second is the run id)
+CELLS_LOCK_KEY = 2020
+
+CELLS_SQL = """
+INSERT INTO {cell} (run_id, zoom, cell_x, cell_y, count, x, y, cluster_id)
+SELECT %(run)s, zoom, cell_x, cell_y, count(*), avg(umap_x), avg(umap_y),
+       mode() WITHIN GROUP (ORDER BY cluster_id)
+FROM (
+    SELECT p.umap_x, p.umap_y, p.cluster_id, z.zoom,
+           LEAST(floor((p.umap_x - %(min_x)s) / %(width)s * (%(bins)s << z.zoom))::int,
+                 (%(bins)s << z.zoom) - 1) AS cell_x,
+           LEAST(floor((p.umap_y - %(min_y)s) / %(height)s * (%(bins)s << z.zoom))::int,
+                 (%(bins)s << z.zoom) - 1) AS cell_y
+    FROM {point} p CROSS JOIN generate_series(0, %(max_zoom)s) AS z(zoom)
+    WHERE p.run_id = %(run)s AND p.umap_x IS NOT NULL
+) q
+GROUP BY zoom, cell_x, cell_y
+ON CONFLICT DO NOTHING
+"""
+
+POINTS_SQL = """
+SELECT p.company_id, p.umap_x, p.umap_y, p.cluster_id, p.cluster_label, c.name, c.industry
+FROM {point} p JOIN {company} c ON c.id = p.company_id
+WHERE p.run_id = %s AND point(p.umap_x, p.umap_y) <@ box(point(%s, %s), point(%s, %s))
+LIMIT %s
+"""
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def build_cells(run):
+    """
+    Compute the run's bounds and the summary cells of every coarse zoom
+    level. Safe to call concurrently: builders serialize on an advisory lock
+    and later ones find the cells already there.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [CELLS_LOCK_KEY, run.pk])
+        run.refresh_from_db(fields=['bounds', 'point_count'])
+        if run.bounds is not None:
+            return
+
+        extent = run.points.filter(umap_x__isnull=False).aggregate(
+            min_x=Min('umap_x'), min_y=Min('umap_y'), max_x=Max('umap_x'), max_y=Max('umap_y'),
+            count=Count('id'),
+        )
+        run.point_count = extent['count']
+        if extent['count']:
+            run.bounds = [extent['min_x'], extent['min_y'], extent['max_x'], extent['max_y']]
+            cursor.execute(
+                CELLS_SQL.format(cell=_table(ProjectionCell), point=_table(ProjectionPoint)),
+                {
+                    'run': run.pk,
+                    'min_x': extent['min_x'],
+                    'min_y': extent['min_y'],
+                    'width': max(extent['max_x'] - extent['min_x'], 1e-9),
+                    'height': max(extent['max_y'] - extent['min_y'], 1e-9),
+                    'bins': settings.MAP_TILE_BINS,
+                    'max_zoom': settings.MAP_TILE_DETAIL_ZOOM - 1,
+                },
+            )
+        else:
+            run.bounds = [0.0, 0.0, 0.0, 0.0]
+        run.save(update_fields=['bounds', 'point_count'])
+
+
+def _cell_range(run, zoom, lo, hi, axis):
+    """Cell indexes covering [lo, hi] on one axis at `zoom`."""
+    cells = settings.MAP_TILE_BINS << zoom
+    start, end = run.bounds[axis], run.bounds[axis + 2]
+    size = max(end - start, 1e-9) / cells
+    first = max(0, int((lo - start) // size))
+    last = min(cells - 1, int((hi - start) // size))
+    return first, last
+
+
+def query_tile(run, zoom, bbox=None):
+    """
+    Map content of `run` inside `bbox` ((min_x, min_y, max_x, max_y), default
+    the whole map) at `zoom`: summary cells below MAP_TILE_DETAIL_ZOOM,
+    at most MAP_TILE_POINT_LIMIT points from it on.
+    """
+    if run.bounds is None:
+        build_cells(run)
+
+    bbox = bbox or run.bounds
+    result = {
+        'run': run.pk,
+        'zoom': zoom,
+        'bounds': run.bounds,
+        'count': run.point_count,
+        'detail_zoom': settings.MAP_TILE_DETAIL_ZOOM,
+    }
+
+    if zoom < settings.MAP_TILE_DETAIL_ZOOM:
+        first_x, last_x = _cell_range(run, zoom, bbox[0], bbox[2], 0)
+        first_y, last_y = _cell_range(run, zoom, bbox[1], bbox[3], 1)
+        cells = list(
+            run.cells
+            .filter(zoom=zoom, cell_x__range=(first_x, last_x), cell_y__range=(first_y, last_y))
+            .values_list('x', 'y', 'count', 'cluster_id')
+        )
+        xs, ys, counts, cluster_ids = zip(*cells) if cells else ([],) * 4
+        result['kind'] = 'cells'
+        result['cells'] = {
+            'x': xs, 'y': ys, 'count': counts, 'cluster_id': cluster_ids,
+        }
+        return result
+
+    limit = settings.MAP_TILE_POINT_LIMIT
+    with connection.cursor() as cursor:
+        cursor.execute(
+            POINTS_SQL.format(point=_table(ProjectionPoint), company=_table(Company)),
+            [run.pk, bbox[0], bbox[1], bbox[2], bbox[3], limit + 1],
+        )
+        rows = cursor.fetchall()
+
+    result['kind'] = 'points'
+    result['truncated'] = len(rows) > limit
+    rows = rows[:limit]
+    ids, xs, ys, cluster_ids, labels, names, industries = zip(*rows) if rows else ([],) * 7
+    result['points'] = {
+        'id': ids,
+        'x': xs,
+        'y': ys,
+        'cluster_id': cluster_ids,
+        'cluster_label': [label or 'Unknown' for label in labels],
+        'name': names,
+        'industry': [industry or 'Unknown' for industry in industries],
+    }
+    return result
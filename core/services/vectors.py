@@ -0,0 +1,164 @@
+"""
+Bulk loading of embedding vectors into contiguous float32 arrays.
+
+Vectors are streamed out of Postgres with a binary COPY and decoded straight
+into a preallocated (n, dims) float32 array, without building model
+instances or per-row Python lists. Full-table loads can be cached as .npy
+files keyed by embedding_version() and reopened memory-mapped.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max
+
+logger = logging.getLogger(__name__)
+
+_COPY_HEADER_SIZE = 19  # signature (11) + flags (4) + header extension length (4)
+
+
+def _record_dtype(dims):
+    """One binary COPY tuple of (bigint, vector): field headers plus payloads, big-endian."""
+    return np.dtype([
+        ('n_fields', '>i2'),
+        ('id_size', '>i4'),
+        ('id', '>i8'),
+        ('vector_size', '>i4'),
+        ('dims', '>i2'),
+        ('unused', '>i2'),
+        ('vector', '>f4', (dims,)),
+    ])
+
+
+def embedding_version():
+    """Fingerprint of the embedding table; changes whenever vectors are written or removed."""
+    from core.models import CompanyEmbedding
+
+    stats = CompanyEmbedding.objects.aggregate(
+        count=Count('id'), max_id=Max('id'), last_embedded=Max('embedded_at'),
+    )
+    key = f"{settings.SBERT_MODEL_NAME}:{stats['count']}:{stats['max_id']}:{stats['last_embedded']}"
+    return hashlib.md5(key.encode()).hexdigest()[:16]
+
+
+def _copy_into(cursor, sql, params, ids, vectors):
+    """Stream `sql` (company_id, vector) rows via binary COPY into the given arrays."""
+    record = _record_dtype(vectors.shape[1])
+    pending = bytearray()
+    skip = _COPY_HEADER_SIZE
+    row = 0
+
+    with cursor.copy(f'COPY ({sql}) TO STDOUT (FORMAT BINARY)', params) as copy:
+        for data in copy:
+            pending += data
+            if skip:
+                dropped = min(skip, len(pending))
+                del pending[:dropped]
+                skip -= dropped
+            complete = min(len(pending) // record.itemsize, len(ids) - row)
+            if not complete:
+                continue
+            records = np.frombuffer(pending, dtype=record, count=complete)
+            if (records['dims'] != vectors.shape[1]).any():
+                raise ValueError(f'Expected {vectors.shape[1]}-dimensional vectors')
+            ids[row:row + complete] = records['id']
+            vectors[row:row + complete] = records['vector']
+            row += complete
+            del records
+            del pending[:complete * record.itemsize]
+
+    if row != len(ids):
+        raise RuntimeError(f'COPY returned {row} rows, expected {len(ids)}')
+
+
+def _load(queryset, allocate):
+    dims = settings.SBERT_VECTOR_DIMENSIONS
+    qs = queryset.order_by('company_id').values_list('company_id', 'vector')
+    sql, params = qs.query.sql_with_params()
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Count and COPY must see the same rows
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            n = qs.count()
+            ids, vectors = allocate(n, dims)
+            _copy_into(cursor, sql, params, ids, vectors)
+    return ids, vectors
+
+
+def load_vectors(queryset=None, cache=None):
+    """
+    Load (company_ids, vectors) for a CompanyEmbedding queryset, ordered by company id.
+
+    Returns an int64 array of shape (n,) and a C-contiguous float32 array of
+    shape (n, dims). Without a queryset the whole table is loaded and, with
+    `cache` (default VECTOR_CACHE), kept as .npy files keyed by
+    embedding_version() and returned read-only memory-mapped.
+    """
+    from core.models import CompanyEmbedding
+
+    if queryset is not None:
+        return _load(queryset, lambda n, dims: (
+            np.empty(n, dtype=np.int64), np.empty((n, dims), dtype=np.float32),
+        ))
+
+    cache = settings.VECTOR_CACHE if cache is None else cache
+    if not cache:
+        return load_vectors(CompanyEmbedding.objects.all())
+
+    directory = Path(settings.VECTOR_CACHE_DIR)
+    version = embedding_version()
+    ids_path = directory / f'{version}.ids.npy'
+    vectors_path = directory / f'{version}.vectors.npy'
+    if not (ids_path.exists() and vectors_path.exists()):
+        _write_cache(directory, version, ids_path, vectors_path)
+    return np.load(ids_path, mmap_mode='r'), np.load(vectors_path, mmap_mode='r')
+
+
+def _write_cache(directory, version, ids_path, vectors_path):
+    """Write the cache files of `version`, one process at a time, and drop older versions."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'write.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Another process may have written it while we waited
+            if not (ids_path.exists() and vectors_path.exists()):
+                _write_version(directory, version, ids_path, vectors_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_version(directory, version, ids_path, vectors_path):
+    from core.models import CompanyEmbedding
+
+    tmp_ids = directory / f'{version}.ids.{os.getpid()}.tmp.npy'
+    tmp_vectors = directory / f'{version}.vectors.{os.getpid()}.tmp.npy'
+
+    def allocate(n, dims):
+        return (
+            np.lib.format.open_memmap(tmp_ids, mode='w+', dtype=np.int64, shape=(n,)),
+            np.lib.format.open_memmap(tmp_vectors, mode='w+', dtype=np.float32, shape=(n, dims)),
+        )
+
+    try:
+        ids, vectors = _load(CompanyEmbedding.objects.all(), allocate)
+        ids.flush()
+        vectors.flush()
+        del ids, vectors
+        tmp_ids.replace(ids_path)
+        tmp_vectors.replace(vectors_path)
+    finally:
+        tmp_ids.unlink(missing_ok=True)
+        tmp_vectors.unlink(missing_ok=True)
+    logger.info('Cached embedding vectors version %s', version)
+
+    # Only published files: temporary ones belong to their writer
+    for pattern in ('*.ids.npy', '*.vectors.npy'):
+        for path in directory.glob(pattern):
+            if not path.name.startswith(version):
+                path.unlink(missing_ok=True)
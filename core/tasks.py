@@ -1,4 +1,5 @@
 import logging
+from itertools import islice
 
 from celery import shared_task
 from django.db.models import Count
@@ -39,104 +40,502 @@ def scrape_pending_companies_task(limit=500):
     return {'dispatched': count}
 
 
-@shared_task
-def generate_embeddings_task(company_ids=None):
-    """Generate SBERT embeddings for companies with scraped data."""
-    import numpy as np
-    from core.models import Company, ScrapedData, CompanyEmbedding
-    from core.services.embeddings import embed_texts_batch
+def _windows(iterable, size):
+    """Yield successive lists of at most `size` items from an iterable."""
+    iterator = iter(iterable)
+    while True:
+        window = list(islice(iterator, size))
+        if not window:
+            return
+        yield window
+
+
+def _save_embeddings(rows, vectors):
+    """
+    Upsert the CompanyEmbedding rows for one embedded window.
+
+    `rows` are (company_id, text_content, content_hash, *filter values)
+    tuples aligned with `vectors`, the filter values being the company's
+    FILTER_FIELDS; the hash and model name are stored for incremental runs.
+    The filter columns are written by the same upsert, so the rows are not
+    updated (and re-indexed) a second time.
+    """
+    from django.conf import settings
+    from django.utils import timezone
+    from core.models import CompanyEmbedding
+    from core.services.bulk import copy_upsert
+    from core.services.search import FILTER_FIELDS
+
+    # Later rows win if a company has more than one ScrapedData record.
+    latest = {row[0]: (i, row[2], row[3:]) for i, row in enumerate(rows)}
+
+    now = timezone.now()
+    # A newer embedded_at invalidates the company's projection point: the
+    # next projection run does not carry it over and places it again.
+    copy_upsert(
+        CompanyEmbedding,
+        [
+            'company', 'vector', 'content_hash', 'model_name', 'embedded_at', 'created_at',
+            *FILTER_FIELDS,
+        ],
+        (
+            (cid, vectors[i], content_hash, settings.SBERT_MODEL_NAME, now, now, *filters)
+            for cid, (i, content_hash, filters) in latest.items()
+        ),
+        conflict_fields=['company'],
+        update_fields=['vector', 'content_hash', 'model_name', 'embedded_at', *FILTER_FIELDS],
+    )
 
-    qs = ScrapedData.objects.select_related('company')
+
+def _embedding_queryset(company_ids=None, id_range=None, force=False):
+    """ScrapedData rows that need embedding, optionally restricted to ids or an id range."""
+    from django.conf import settings
+    from django.db.models import Exists, OuterRef
+    from django.db.models.functions import Length
+    from core.models import ScrapedData, CompanyEmbedding
+
+    qs = (
+        ScrapedData.objects
+        .annotate(text_length=Length('text_content'))
+        .filter(text_length__gt=50)
+    )
     if company_ids:
         qs = qs.filter(company_id__in=company_ids)
+    if id_range:
+        lo, hi = id_range
+        qs = qs.filter(company_id__gte=lo)
+        if hi is not None:
+            qs = qs.filter(company_id__lt=hi)
+    if not force:
+        up_to_date = CompanyEmbedding.objects.filter(
+            company_id=OuterRef('company_id'),
+            content_hash=OuterRef('content_hash'),
+            model_name=settings.SBERT_MODEL_NAME,
+        )
+        qs = qs.exclude(Exists(up_to_date))
+    return qs
+
+
+@shared_task
+def generate_embeddings_task(company_ids=None, window_size=None, force=False, id_range=None):
+    """
+    Generate SBERT embeddings for companies with scraped data.
+
+    Only companies without an embedding, whose text changed, or embedded with
+    another model are processed unless `force` is set. `id_range` is a
+    [lo, hi) pair of company ids (hi may be None) used by sharded runs.
+    Rows are streamed from a server-side cursor and embedded and saved one
+    window at a time, so memory is bounded by the window size and progress
+    survives a worker dying mid-run.
+    """
+    from django.conf import settings
+    from core.services.embeddings import embed_texts_batch
+    from core.services.search import FILTER_FIELDS, sync_filter_columns
 
-    items = list(qs.filter(text_content__isnull=False))
-    items = [item for item in items if len(item.text_content) > 50]
+    window_size = window_size or settings.EMBEDDING_WINDOW_SIZE
+    fields = ['company_id', 'text_content', 'content_hash', *(f'company__{name}' for name in FILTER_FIELDS)]
 
-    if not items:
+    rows = (
+        _embedding_queryset(company_ids, id_range, force)
+        .order_by('company_id')
+        .values_list(*fields)
+        .iterator(chunk_size=window_size)
+    )
+
+    processed = 0
+    stats = {}
+    for window in _windows(rows, window_size):
+        vectors = embed_texts_batch([row[1] for row in window], stats=stats)
+        _save_embeddings(window, vectors)
+        processed += len(window)
+        logger.info(
+            'Embedded %d companies (up to id %d), %d chunks, %d tokens skipped',
+            processed, window[-1][0], stats['chunks'], stats['skipped_tokens'],
+        )
+
+    if company_ids is None and id_range is None:
+        # Pick up industry/country/state/size edits on companies not re-embedded
+        sync_filter_columns()
+
+    if not processed:
         return {'processed': 0, 'message': 'No data to embed'}
 
-    texts = [item.text_content for item in items]
-    vectors = embed_texts_batch(texts)
+    if id_range is None:
+        # Sharded runs rebuild once, from the chord callback
+        build_ann_index_task.delay()
+        if company_ids is None:
+            build_neighbors_task.delay()
+    return {'processed': processed, **stats}
+
 
-    objs_to_create = []
-    objs_to_update = []
+def _shard_ranges(company_ids, shard_size):
+    """Split a sorted stream of company ids into [lo, hi) ranges of ~shard_size rows."""
+    ranges = []
+    lo = None
+    for i, cid in enumerate(company_ids):
+        if i % shard_size == 0:
+            if lo is not None:
+                ranges.append([lo, cid])
+            lo = cid
+    if lo is not None:
+        ranges.append([lo, None])
+    return ranges
 
-    existing = set(
-        CompanyEmbedding.objects.filter(
-            company_id__in=[item.company_id for item in items]
-        ).values_list('company_id', flat=True)
+
+@shared_task
+def dispatch_embedding_shards_task(force=False, shard_size=None, project=True):
+    """
+    Fan embedding out over Celery workers as a chord of company-id range shards.
+
+    Shards are cut so each holds ~shard_size companies that actually need
+    embedding. The chord callback aggregates the shard results and, if
+    `project` is set, schedules compute_projections_task.
+    """
+    from celery import chord
+    from django.conf import settings
+
+    shard_size = shard_size or settings.EMBEDDING_SHARD_SIZE
+
+    ids = (
+        _embedding_queryset(force=force)
+        .order_by('company_id')
+        .values_list('company_id', flat=True)
+        .iterator(chunk_size=10000)
     )
+    ranges = _shard_ranges(ids, shard_size)
+    if not ranges:
+        if project:
+            compute_projections_task.delay()
+        return {'shards': 0, 'message': 'No data to embed'}
+
+    options = {'queue': settings.EMBEDDING_QUEUE} if settings.EMBEDDING_QUEUE else {}
+    header = [
+        generate_embeddings_task.signature(kwargs={'id_range': r, 'force': force}, options=options)
+        for r in ranges
+    ]
+    chord(header)(finalize_embedding_shards_task.s(project=project))
+
+    logger.info('Dispatched %d embedding shards', len(ranges))
+    return {'shards': len(ranges)}
+
+
+@shared_task
+def finalize_embedding_shards_task(results, project=True):
+    """Chord callback: aggregate shard counts and trigger the projection stage."""
+    from core.services.search import sync_filter_columns
+
+    totals = {'shards': len(results)}
+    for result in results:
+        for key in ('processed', 'tokens', 'chunks', 'skipped_tokens', 'encoded_chunks'):
+            totals[key] = totals.get(key, 0) + result.get(key, 0)
+    # Pick up industry/country/state/size edits on companies not re-embedded
+    sync_filter_columns()
+    if totals.get('processed'):
+        build_ann_index_task.delay()
+        build_neighbors_task.delay()
+    if project:
+        compute_projections_task.delay()
+    return totals
 
-    for i, item in enumerate(items):
-        vec = vectors[i].tolist()
-        if item.company_id in existing:
-            emb = CompanyEmbedding.objects.get(company_id=item.company_id)
-            emb.vector = vec
-            objs_to_update.append(emb)
-        else:
-            objs_to_create.append(CompanyEmbedding(
-                company_id=item.company_id,
-                vector=vec,
-            ))
 
-    if objs_to_create:
-        CompanyEmbedding.objects.bulk_create(objs_to_create)
-    if objs_to_update:
-        CompanyEmbedding.objects.bulk_update(objs_to_update, ['vector'])
+@shared_task
+def build_ann_index_task(force=False):
+    """Rebuild and publish the in-process vector index, if VECTOR_SEARCH_BACKEND uses one."""
+    from django.conf import settings
+    from core.services import ann
 
-    return {'processed': len(items)}
+    if settings.VECTOR_SEARCH_BACKEND not in ann.ANN_BACKENDS:
+        return {'message': 'VECTOR_SEARCH_BACKEND does not use an in-process index'}
+    return {'version': ann.build_index(force=force)}
 
 
 @shared_task
-def compute_projections_task():
-    """Compute UMAP projections and HDBSCAN clusters, then update DB."""
+def build_neighbors_task(k=None):
+    """Recompute the precomputed top-k neighbours served by /api/similar/."""
+    from core.services.neighbors import build_neighbors
+
+    return {'companies': build_neighbors(k)}
+
+
+PROJECTION_STAGES = ('display', 'clusters')
+
+
+def _projection_meta(company_ids, previous):
+    """
+    Per-company (cluster_id in the `previous` run or -1, industry) aligned
+    with `company_ids`, plus landmark strata: previous cluster, falling back
+    to industry.
+    """
     import numpy as np
-    from core.models import CompanyEmbedding
-    from core.services.embeddings import compute_umap_projection, compute_hdbscan_clusters
+    from core.models import CompanyEmbedding, ProjectionPoint
+
+    clusters = {}
+    if previous is not None:
+        clusters = dict(
+            ProjectionPoint.objects.filter(run=previous, cluster_id__isnull=False)
+            .values_list('company_id', 'cluster_id')
+            .iterator(chunk_size=10000)
+        )
+    industries = dict(
+        CompanyEmbedding.objects.values_list('company_id', 'company__industry').iterator(chunk_size=10000)
+    )
+    ids = company_ids.tolist()
+    previous_ids = np.array([clusters.get(cid, -1) for cid in ids])
+    industries = [industries.get(cid) for cid in ids]
+    strata = [
+        f'c{cluster}' if cluster >= 0 else f'i{industry}'
+        for cluster, industry in zip(previous_ids.tolist(), industries)
+    ]
+    return previous_ids, industries, strata
+
+
+def _write_points(run, fields, rows):
+    """Upsert (company_id, *fields) rows into the snapshot of `run`."""
+    from core.models import ProjectionPoint
+    from core.services.bulk import copy_upsert
+
+    return copy_upsert(
+        ProjectionPoint,
+        ['run', 'company', *fields],
+        ((run.pk, *row) for row in rows),
+        conflict_fields=['run', 'company'],
+    )
+
+
+def _missing_points(run, field):
+    """CompanyEmbedding rows whose point in `run` has no value for `field` yet."""
+    from django.db.models import Exists, OuterRef
+    from core.models import CompanyEmbedding, ProjectionPoint
+
+    placed = ProjectionPoint.objects.filter(
+        run=run, company_id=OuterRef('company_id'), **{f'{field}__isnull': False},
+    )
+    return CompanyEmbedding.objects.exclude(Exists(placed))
 
-    embeddings = list(CompanyEmbedding.objects.select_related('company').all())
-    if len(embeddings) < 3:
+
+def _refit_display(run, previous):
+    """Fit the 2-D map UMAP on every embedding, persist the reducer and write the run's coordinates."""
+    from core.services import artifacts
+    from core.services.embeddings import fit_landmark_umap
+    from core.services.vectors import load_vectors
+
+    company_ids, vectors = load_vectors()
+    if len(company_ids) < 3:
         return {'message': 'Not enough embeddings for projection'}
 
-    vectors = np.array([emb.vector for emb in embeddings])
+    _previous, _industries, strata = _projection_meta(company_ids, previous)
+    reducer, coords = fit_landmark_umap(vectors, strata)
 
-    coords = compute_umap_projection(vectors)
-    labels = compute_hdbscan_clusters(coords)
+    updated = _write_points(
+        run,
+        ['umap_x', 'umap_y'],
+        zip(company_ids.tolist(), coords[:, 0].tolist(), coords[:, 1].tolist()),
+    )
 
-    # Build cluster label from most common industry per cluster
+    version = artifacts.new_version()
+    artifacts.save_artifacts('display', version, umap=reducer)
+
+    return {'mode': 'full', 'version': version, 'updated': updated}
+
+
+def _project_new_display(run, version, reducer):
+    """Place embeddings without map coordinates in `run` with the persisted reducer."""
+    from core.services.embeddings import transform_umap_projection
+    from core.services.vectors import load_vectors
+
+    company_ids, vectors = load_vectors(_missing_points(run, 'umap_x'))
+    if not len(company_ids):
+        return {'mode': 'incremental', 'version': version, 'updated': 0}
+
+    coords = transform_umap_projection(reducer, vectors)
+    updated = _write_points(
+        run,
+        ['umap_x', 'umap_y'],
+        zip(company_ids.tolist(), coords[:, 0].tolist(), coords[:, 1].tolist()),
+    )
+
+    return {'mode': 'incremental', 'version': version, 'updated': updated}
+
+
+def _refit_clusters(run, previous):
+    """
+    Fit the clustering UMAP space and HDBSCAN on every embedding, persist
+    both and write the run's cluster ids and labels.
+    """
     from collections import Counter
+    from core.services import artifacts
+    from core.services.embeddings import (
+        align_cluster_ids, fit_cluster_space, fit_hdbscan_clusters,
+    )
+    from core.services.vectors import load_vectors
+
+    company_ids, vectors = load_vectors()
+    if len(company_ids) < 3:
+        return {'message': 'Not enough embeddings for clustering'}
+
+    previous_ids, industries, strata = _projection_meta(company_ids, previous)
+    reducer, space = fit_cluster_space(vectors, strata)
+    clusterer, raw_labels = fit_hdbscan_clusters(space)
+
+    # Keep cluster ids stable across refits so the map keeps its colors
+    labels, cluster_ids = align_cluster_ids(raw_labels, previous_ids)
+
+    # Build cluster label from most common industry per cluster
     cluster_industries = {}
-    for i, emb in enumerate(embeddings):
-        cid = int(labels[i])
+    for cid, industry in zip(labels.tolist(), industries):
         if cid == -1:
             continue
-        industry = emb.company.industry or 'Unknown'
-        cluster_industries.setdefault(cid, []).append(industry)
+        cluster_industries.setdefault(cid, []).append(industry or 'Unknown')
 
     cluster_labels = {}
-    for cid, industries in cluster_industries.items():
-        most_common = Counter(industries).most_common(1)[0][0]
+    for cid, names in cluster_industries.items():
+        most_common = Counter(names).most_common(1)[0][0]
         cluster_labels[cid] = most_common
 
-    for i, emb in enumerate(embeddings):
-        emb.umap_x = float(coords[i][0])
-        emb.umap_y = float(coords[i][1])
-        emb.cluster_id = int(labels[i])
-        emb.cluster_label = cluster_labels.get(int(labels[i]), 'Noise')
+    updated = _write_points(
+        run,
+        ['cluster_id', 'cluster_label'],
+        (
+            (cid, int(label), cluster_labels.get(int(label), 'Noise'))
+            for cid, label in zip(company_ids.tolist(), labels.tolist())
+        ),
+    )
 
-    CompanyEmbedding.objects.bulk_update(
-        embeddings, ['umap_x', 'umap_y', 'cluster_id', 'cluster_label']
+    version = artifacts.new_version()
+    artifacts.save_artifacts(
+        'clusters',
+        version,
+        umap=reducer,
+        hdbscan=clusterer,
+        clusters={'ids': cluster_ids, 'labels': cluster_labels},
     )
 
-    return {'updated': len(embeddings), 'clusters': len(cluster_labels)}
+    return {
+        'mode': 'full',
+        'version': version,
+        'updated': updated,
+        'clusters': len(cluster_labels),
+    }
+
+
+def _cluster_new_embeddings(run, previous, version, reducer):
+    """
+    Assign embeddings without a cluster in `run` to the persisted clusters:
+    they are placed in the clustering space with the persisted reducer, then
+    labelled with approximate_predict.
+    """
+    from core.services import artifacts
+    from core.services.embeddings import predict_hdbscan_clusters, transform_umap_projection
+    from core.services.vectors import load_vectors
+
+    clusterer = artifacts.load_artifact('clusters', 'hdbscan', version)
+    clusters = artifacts.load_artifact('clusters', 'clusters', version)
+    if clusterer is None or clusters is None:
+        return _refit_clusters(run, previous)
+
+    company_ids, vectors = load_vectors(_missing_points(run, 'cluster_id'))
+    if not len(company_ids):
+        return {'mode': 'incremental', 'version': version, 'updated': 0}
+
+    space = transform_umap_projection(reducer, vectors)
+    raw_labels = predict_hdbscan_clusters(clusterer, space)
+    cluster_ids = [clusters['ids'].get(int(label), -1) for label in raw_labels]
+    updated = _write_points(
+        run,
+        ['cluster_id', 'cluster_label'],
+        (
+            (cid, cluster_id, clusters['labels'].get(cluster_id, 'Noise'))
+            for cid, cluster_id in zip(company_ids.tolist(), cluster_ids)
+        ),
+    )
+
+    return {'mode': 'incremental', 'version': version, 'updated': updated}
+
+
+def _display_stage(run, previous, refit):
+    from core.services import artifacts
+
+    version = (previous and previous.display_version) or artifacts.latest_version('display')
+    reducer = None if refit else artifacts.load_artifact('display', 'umap', version)
+    if reducer is None:
+        result = _refit_display(run, previous)
+    else:
+        result = _project_new_display(run, version, reducer)
+    run.display_version = result.get('version')
+    return result
+
+
+def _clusters_stage(run, previous, refit):
+    from core.services import artifacts
+
+    version = (previous and previous.clusters_version) or artifacts.latest_version('clusters')
+    reducer = None if refit else artifacts.load_artifact('clusters', 'umap', version)
+    if reducer is None:
+        result = _refit_clusters(run, previous)
+    else:
+        result = _cluster_new_embeddings(run, previous, version, reducer)
+    run.clusters_version = result.get('version')
+    return result
+
+
+@shared_task
+def compute_projections_task(refit=False, stages=PROJECTION_STAGES):
+    """
+    Build a new projection snapshot and make it the active one.
+
+    The new ProjectionRun starts from the active run's points whose
+    embedding is unchanged; the display projection and clustering stages
+    then fill in the rest. By default each stage only places the missing
+    points with the models persisted by its last refit; `refit` (or missing
+    models) refits the stage on the whole corpus. Stages are independent and
+    can be run alone by passing a subset of PROJECTION_STAGES. The tile
+    summaries and map payloads are pre-rendered, then the run is activated;
+    readers keep seeing the previous snapshot until then.
+    """
+    from core.models import ProjectionRun
+    from core.services import map_snapshot, projections, tiles
+
+    stage_functions = {'display': _display_stage, 'clusters': _clusters_stage}
+
+    previous = projections.active_run()
+    run = projections.start_run(previous)
+    try:
+        result = {stage: stage_functions[stage](run, previous, refit) for stage in stages}
+        tiles.build_cells(run)
+    except Exception:
+        projections.fail_run(run)
+        raise
+
+    projections.finish_run(run, result)
+    try:
+        map_snapshot.render_snapshots(run)
+    except Exception:
+        # Not fatal: the first map request builds it instead
+        logger.exception('Could not render map snapshots for projection run %d', run.pk)
+    projections.activate_run(run)
+    deleted = projections.collect_garbage()
+    map_snapshot.prune(ProjectionRun.objects.values_list('pk', flat=True))
+    logger.info('Activated projection run %d (%d old runs deleted)', run.pk, deleted)
+    return {'run': run.pk, **result}
+
+
+@shared_task
+def compute_display_projection_task(refit=False):
+    """Build a new snapshot updating only the 2-D map coordinates."""
+    return compute_projections_task(refit=refit, stages=['display'])
+
+
+@shared_task
+def compute_clusters_task(refit=False):
+    """Build a new snapshot updating only the HDBSCAN clusters."""
+    return compute_projections_task(refit=refit, stages=['clusters'])
 
 
 @shared_task
-def full_pipeline_task():
+def full_pipeline_task(force=False, refit=False):
     """Run embeddings then projections sequentially."""
-    result_embed = generate_embeddings_task()
-    result_proj = compute_projections_task()
+    result_embed = generate_embeddings_task(force=force)
+    result_proj = compute_projections_task(refit=refit)
     return {
         'embeddings': result_embed,
         'projections': result_proj,
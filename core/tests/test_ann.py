@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from core.services import ann
+from core.services.ann import ExactIndex
+
+
+def brute_force(ids, vectors, query, k):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    distances = 1.0 - unit @ (query / np.linalg.norm(query))
+    order = np.argsort(distances, kind='stable')[:k]
+    return ids[order], distances[order]
+
+
+@override_settings(ANN_BLOCK_SIZE=16)
+class ExactIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.ids = np.arange(1000, 1100, dtype=np.int64)
+        self.vectors = rng.standard_normal((100, 8)).astype(np.float32)
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        ExactIndex.build(self.directory, self.ids, self.vectors)
+        self.index = ExactIndex.load(self.directory)
+
+    def test_matches_brute_force_across_blocks(self):
+        rng = np.random.default_rng(1)
+        for k in (1, 5, 16, 17, 40):
+            with self.subTest(k=k):
+                query = rng.standard_normal(8).astype(np.float32)
+                ids, distances = self.index.search(query, k)
+                expected_ids, expected_distances = brute_force(self.ids, self.vectors, query, k)
+                np.testing.assert_array_equal(ids, expected_ids)
+                np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+    def test_a_stored_vector_is_its_own_nearest(self):
+        ids, distances = self.index.search(self.vectors[42] * 3, 1)
+        self.assertEqual(ids.tolist(), [1042])
+        self.assertAlmostEqual(float(distances[0]), 0.0, places=5)
+
+    def test_k_larger_than_the_index(self):
+        ids, _distances = self.index.search(self.vectors[0], 500)
+        self.assertEqual(sorted(ids.tolist()), self.ids.tolist())
+
+
+class PublishTests(SimpleTestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp()) / 'numpy'
+        self.root.mkdir()
+        self.addCleanup(shutil.rmtree, self.root.parent, True)
+        self.addCleanup(ann._loaded.clear)
+        self.addCleanup(ann._checked_at.clear)
+
+    def publish(self, version, age=0):
+        directory = self.root / version
+        directory.mkdir()
+        ExactIndex.build(directory, np.arange(3), np.eye(3, dtype=np.float32))
+        (directory / 'meta.json').write_text('{"count": 3, "dims": 3}')
+        stamp = time.time() - age
+        os.utime(directory, (stamp, stamp))
+        (self.root / 'LATEST').write_text(version)
+
+    @override_settings(ANN_RELOAD_INTERVAL=60)
+    def test_prune_keeps_recent_previous_and_temporary_versions(self):
+        for version in ('old', 'previous', 'recent'):
+            self.publish(version, age=0 if version == 'recent' else 3600)
+        (self.root / 'other.123.tmp').mkdir()
+        self.publish('current')
+
+        ann._prune(self.root, {'current', 'previous'})
+        self.assertEqual(
+            sorted(path.name for path in self.root.iterdir() if path.is_dir()),
+            ['current', 'other.123.tmp', 'previous', 'recent'],
+        )
+
+    def test_keeps_serving_when_a_new_version_fails_to_load(self):
+        with self.settings(ANN_INDEX_DIR=str(self.root.parent), ANN_RELOAD_INTERVAL=0):
+            self.publish('v1')
+            index = ann.get_index('numpy')
+            self.assertEqual(len(index), 3)
+
+            (self.root / 'LATEST').write_text('missing')
+            with self.assertLogs('core.services.ann', 'ERROR'):
+                self.assertIs(ann.get_index('numpy'), index)
@@ -0,0 +1,154 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from core.services.chunk_cache import chunk_key
+from core.services.embeddings import (
+    align_cluster_ids, cache_model_name, chunk_texts, cluster_size_params, parallel_backend,
+    stratified_sample,
+)
+
+
+class AlignClusterIdsTests(SimpleTestCase):
+    def test_reuses_previous_ids_by_overlap(self):
+        labels = [0, 0, 0, 1, 1, -1]
+        previous = [7, 7, 3, 3, 3, 7]
+        aligned, mapping = align_cluster_ids(labels, previous)
+        self.assertEqual(aligned.tolist(), [7, 7, 7, 3, 3, -1])
+        self.assertEqual(mapping, {0: 7, 1: 3, -1: -1})
+
+    def test_each_previous_id_used_once(self):
+        labels = [0, 0, 1, 2]
+        previous = [5, 5, 5, -1]
+        aligned, _mapping = align_cluster_ids(labels, previous)
+        self.assertEqual(aligned.tolist(), [5, 5, 6, 7])
+
+    def test_no_previous_run(self):
+        aligned, _mapping = align_cluster_ids([1, 0, -1], [-1, -1, -1])
+        self.assertEqual(aligned.tolist(), [1, 0, -1])
+
+
+class FakeTokenizer:
+    """One token per space-separated word."""
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def __call__(self, texts, **kwargs):
+        offsets = []
+        for text in texts:
+            spans, position = [], 0
+            for word in text.split():
+                start = text.index(word, position)
+                position = start + len(word)
+                spans.append((start, position))
+            offsets.append(spans)
+        return {'offset_mapping': offsets}
+
+
+class FakeModel:
+    tokenizer = FakeTokenizer()
+    max_seq_length = 6  # windows of 4 tokens
+
+
+def words(n):
+    return ' '.join(f'w{i}' for i in range(n))
+
+
+class ChunkTextsTests(SimpleTestCase):
+    def chunk(self, texts, **kwargs):
+        kwargs.setdefault('overlap', 1)
+        kwargs.setdefault('max_chunks', 0)
+        return chunk_texts(texts, model=FakeModel(), **kwargs)
+
+    def test_short_and_empty_texts_are_one_chunk(self):
+        self.assertEqual(self.chunk([words(4), '']), [[words(4)], ['']])
+
+    def test_overlapping_windows_cover_the_text(self):
+        stats = {}
+        chunks = self.chunk([words(10)], stats=stats)[0]
+        self.assertEqual(chunks, ['w0 w1 w2 w3', 'w3 w4 w5 w6', 'w6 w7 w8 w9'])
+        self.assertEqual(stats, {'tokens': 10, 'chunks': 3, 'skipped_tokens': 0})
+
+    def test_cap_keeps_head_and_samples_the_rest(self):
+        stats = {}
+        chunks = self.chunk([words(30)], max_chunks=4, stats=stats)[0]
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[:2], ['w0 w1 w2 w3', 'w3 w4 w5 w6'])
+        self.assertTrue(chunks[-1].endswith('w29'))
+        self.assertGreater(stats['skipped_tokens'], 0)
+
+    def test_zero_cap_means_no_cap(self):
+        self.assertEqual(len(self.chunk([words(30)], max_chunks=0)[0]), 10)
+
+    def test_every_text_has_a_chunk(self):
+        for n in range(12):
+            for overlap in range(4):
+                with self.subTest(n=n, overlap=overlap):
+                    self.assertTrue(self.chunk([words(n)], overlap=overlap, max_chunks=1)[0])
+
+    def test_rejects_overlap_outside_the_window(self):
+        for overlap in (-1, 4, 10):
+            with self.subTest(overlap=overlap), self.assertRaises(ValueError):
+                self.chunk([words(10)], overlap=overlap)
+
+
+class ChunkCacheKeyTests(SimpleTestCase):
+    def test_chunk_key_ignores_whitespace_and_unicode_forms(self):
+        self.assertEqual(chunk_key('Caf\u00e9  au\nlait '), chunk_key('Cafe\u0301 au lait'))
+        self.assertNotEqual(chunk_key('cafe au lait'), chunk_key('Cafe au lait'))
+
+    def test_backends_are_cached_apart(self):
+        names = set()
+        for backend in ('torch', 'onnx', 'onnx-int8'):
+            with self.settings(SBERT_MODEL_NAME='mini', SBERT_BACKEND=backend):
+                names.add(cache_model_name())
+        self.assertEqual(names, {'mini', 'mini:onnx', 'mini:onnx-int8'})
+
+
+class StratifiedSampleTests(SimpleTestCase):
+    def test_every_stratum_in_proportion(self):
+        strata = np.array([0] * 900 + [1] * 90 + [2] * 10)
+        picked = stratified_sample(strata, 100)
+        self.assertEqual(len(picked), 100)
+        self.assertEqual(len(set(picked.tolist())), 100)
+        self.assertTrue((np.diff(picked) > 0).all())
+        counts = np.bincount(strata[picked], minlength=3)
+        self.assertEqual(counts.tolist(), [90, 9, 1])
+
+    def test_rare_strata_get_one_point(self):
+        strata = np.array([0] * 995 + [1, 2, 3, 4, 5])
+        counts = np.bincount(strata[stratified_sample(strata, 20)], minlength=6)
+        self.assertTrue((counts[1:] == 1).all())
+        self.assertEqual(counts.sum(), 20)
+
+    def test_reproducible_and_whole_corpus(self):
+        strata = np.arange(50) % 4
+        np.testing.assert_array_equal(stratified_sample(strata, 10), stratified_sample(strata, 10))
+        np.testing.assert_array_equal(stratified_sample(strata, 50), np.arange(50))
+
+
+class ParallelBackendTests(SimpleTestCase):
+    def test_threads_only_in_daemonic_processes(self):
+        self.assertEqual(parallel_backend(), 'loky')
+        with mock.patch('multiprocessing.current_process') as current:
+            current.return_value.daemon = True
+            self.assertEqual(parallel_backend(), 'threading')
+
+
+@override_settings(CLUSTER_MIN_SIZE=5, CLUSTER_MIN_SIZE_FRACTION=0.001, CLUSTER_MIN_SAMPLES=None)
+class ClusterSizeParamsTests(SimpleTestCase):
+    def test_scales_with_the_corpus(self):
+        self.assertEqual(cluster_size_params(1_000_000), (1000, 250))
+        self.assertEqual(cluster_size_params(20_000), (20, 5))
+
+    def test_floors(self):
+        self.assertEqual(cluster_size_params(1000), (5, 3))
+        self.assertEqual(cluster_size_params(3), (3, 3))
+        self.assertEqual(cluster_size_params(1), (2, 2))
+
+    def test_min_samples_setting_is_capped(self):
+        with self.settings(CLUSTER_MIN_SAMPLES=40):
+            self.assertEqual(cluster_size_params(1_000_000), (1000, 40))
+            self.assertEqual(cluster_size_params(1000), (5, 5))
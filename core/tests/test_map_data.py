@@ -0,0 +1,47 @@
+import json
+import struct
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from core.services import map_data
+
+
+class EncodeColumnsTests(SimpleTestCase):
+    def decode(self, payload):
+        self.assertEqual(payload[:4], map_data.MAGIC)
+        (length,) = struct.unpack('<I', payload[4:8])
+        header = json.loads(payload[8:8 + length])
+        body = payload[8 + length + (-(8 + length) % 8):]
+        columns = {}
+        for entry in header['columns']:
+            self.assertEqual(entry['offset'] % 8, 0)
+            dtype = np.dtype(entry['dtype']).newbyteorder('<')
+            columns[entry['name']] = np.frombuffer(
+                body, dtype=dtype, count=entry['length'], offset=entry['offset'],
+            )
+        return header, columns
+
+    def test_round_trip(self):
+        columns = {
+            'id': np.array([3, 1, 2], dtype=np.uint32),
+            'x': np.array([0.5, -1.25, 2.0], dtype=np.float32),
+            'cluster': np.array([1, 0, 1], dtype=np.uint8),
+            'big_endian': np.array([1, 65535, 7], dtype='>u2'),
+        }
+        payload = map_data.encode_columns(9, 3, columns, {'cluster': ['a', 'b']})
+
+        header, decoded = self.decode(payload)
+        self.assertEqual(header['run'], 9)
+        self.assertEqual(header['count'], 3)
+        self.assertEqual(header['dictionaries'], {'cluster': ['a', 'b']})
+        self.assertEqual(list(decoded), list(columns))
+        for name, array in columns.items():
+            np.testing.assert_array_equal(decoded[name], array)
+            self.assertIn(decoded[name].dtype.byteorder, '<|=')
+
+    def test_empty_columns(self):
+        payload = map_data.encode_columns(None, 0, {'x': np.empty(0, dtype=np.float32)}, {})
+        header, decoded = self.decode(payload)
+        self.assertEqual(header['columns'][0]['length'], 0)
+        self.assertEqual(len(decoded['x']), 0)
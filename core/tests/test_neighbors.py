@@ -0,0 +1,34 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from core.services.neighbors import _inverse_norms, _shard_neighbors
+
+
+class ShardNeighborsTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((50, 6)).astype(np.float32)
+        unit = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        self.distances = 1.0 - unit @ unit.T
+        np.fill_diagonal(self.distances, np.inf)
+
+    def test_matches_brute_force_for_any_block_size(self):
+        k = 7
+        expected = np.argsort(self.distances, axis=1, kind='stable')[:, :k]
+        for block in (4, 7, 50, 64):
+            with self.subTest(block=block):
+                inv_norms = _inverse_norms(self.vectors, block)
+                start, indexes, distances = _shard_neighbors(self.vectors, inv_norms, 10, 30, k, block)
+                self.assertEqual(start, 10)
+                np.testing.assert_array_equal(indexes, expected[10:30])
+                np.testing.assert_allclose(
+                    distances, np.take_along_axis(self.distances[10:30], expected[10:30], axis=1),
+                    atol=1e-5,
+                )
+
+    def test_never_returns_the_row_itself(self):
+        inv_norms = _inverse_norms(self.vectors, 8)
+        _start, indexes, _distances = _shard_neighbors(self.vectors, inv_norms, 0, 50, 49, 8)
+        for row, neighbors in enumerate(indexes):
+            self.assertNotIn(row, neighbors.tolist())
+            self.assertEqual(len(set(neighbors.tolist())), 49)
@@ -0,0 +1,60 @@
+from unittest import mock
+
+import numpy as np
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from core.services import query_cache
+
+
+def fake_encode(texts, cache=None):
+    return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+@override_settings(QUERY_CACHE_ALIAS='default', QUERY_CACHE_SIZE=2)
+class QueryCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        query_cache._lru.clear()
+        query_cache._stats.update(l1_hits=0, l2_hits=0, misses=0)
+        patcher = mock.patch('core.services.embeddings.embed_texts_batch', side_effect=fake_encode)
+        self.encode = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_equivalent_queries_share_an_entry(self):
+        first, second = query_cache.get_query_embeddings(['Coffee  Roasters', 'coffee roasters'])
+        np.testing.assert_array_equal(first, second)
+        self.encode.assert_called_once_with(['coffee roasters'], cache=False)
+        self.assertFalse(first.flags.writeable)
+
+    def test_levels_and_stats(self):
+        query_cache.get_query_embedding('a')      # miss
+        query_cache.get_query_embedding('a')      # l1 hit
+        query_cache._lru.clear()
+        query_cache.get_query_embedding('a')      # l2 hit
+        stats = query_cache.cache_stats()
+        self.assertEqual(
+            {key: stats[key] for key in ('l1_hits', 'l2_hits', 'misses', 'l1_size', 'l1_max_size')},
+            {'l1_hits': 1, 'l2_hits': 1, 'misses': 1, 'l1_size': 1, 'l1_max_size': 2},
+        )
+        self.assertEqual(stats['hit_rate'], round(2 / 3, 4))
+        self.assertEqual(self.encode.call_count, 1)
+
+    def test_lru_evicts_least_recently_used(self):
+        for query in ('a', 'b', 'a', 'c'):
+            query_cache.get_query_embedding(query)
+        keys = [query_cache._cache_key(query) for query in ('a', 'b', 'c')]
+        self.assertEqual(list(query_cache._lru), [keys[0], keys[2]])
+
+    def test_keys_depend_on_backend(self):
+        with self.settings(SBERT_BACKEND='torch'):
+            fp32 = query_cache._cache_key('coffee')
+        with self.settings(SBERT_BACKEND='onnx-int8'):
+            int8 = query_cache._cache_key('coffee')
+        self.assertNotEqual(fp32, int8)
+
+    def test_shared_cache_outage_still_encodes(self):
+        with mock.patch.object(caches['default'], 'get_many', side_effect=ConnectionError('down')), \
+                self.assertLogs('core.services.query_cache', 'WARNING'):
+            vector = query_cache.get_query_embedding('tea')
+        np.testing.assert_array_equal(vector, [3, 1])
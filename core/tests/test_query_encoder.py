@@ -0,0 +1,47 @@
+import asyncio
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from core.services import query_encoder
+from core.services.query_encoder import QueryEncoder
+
+
+def fake_encode(texts):
+    return [np.array([len(text)], dtype=np.float32) for text in texts]
+
+
+class QueryEncoderTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(query_encoder, '_encode', side_effect=fake_encode)
+        self.encode = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_callers(self, encoder, *texts):
+        async def main():
+            return await asyncio.gather(*(encoder.encode(list(t)) for t in texts))
+        return asyncio.run(main())
+
+    def batches(self):
+        return [call.args[0] for call in self.encode.call_args_list]
+
+    def test_concurrent_callers_share_one_batch(self):
+        results = self.run_callers(QueryEncoder(max_size=8, max_wait=0.05), ['a', 'bb'], ['bb', 'ccc'])
+        self.assertEqual([[v.tolist() for v in r] for r in results], [[[1], [2]], [[2], [3]]])
+        self.assertEqual(self.batches(), [['a', 'bb', 'ccc']])
+
+    def test_batches_are_capped(self):
+        self.run_callers(QueryEncoder(max_size=2, max_wait=0.05), ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual([len(batch) for batch in self.batches()], [2, 2, 1])
+
+    def test_failed_batch_fails_its_callers_only(self):
+        self.encode.side_effect = [RuntimeError('model crashed'), fake_encode(['ok'])]
+        encoder = QueryEncoder(max_size=8, max_wait=0)
+
+        async def main():
+            with self.assertRaises(RuntimeError), self.assertLogs('core.services.query_encoder', 'ERROR'):
+                await encoder.encode(['boom'])
+            return await encoder.encode(['ok'])
+
+        self.assertEqual(asyncio.run(main())[0].tolist(), [2])
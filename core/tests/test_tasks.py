@@ -0,0 +1,38 @@
+from django.test import SimpleTestCase
+
+from core.tasks import _shard_ranges, _windows
+
+
+class WindowsTests(SimpleTestCase):
+    def test_splits_a_stream_into_bounded_lists(self):
+        self.assertEqual(list(_windows(iter(range(7)), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_exact_multiple_and_empty_stream(self):
+        self.assertEqual(list(_windows(range(4), 2)), [[0, 1], [2, 3]])
+        self.assertEqual(list(_windows([], 5)), [])
+
+    def test_consumes_lazily(self):
+        consumed = []
+
+        def rows():
+            for i in range(10):
+                consumed.append(i)
+                yield i
+
+        windows = _windows(rows(), 4)
+        self.assertEqual(next(windows), [0, 1, 2, 3])
+        self.assertEqual(consumed, [0, 1, 2, 3])
+
+
+class ShardRangesTests(SimpleTestCase):
+    def test_ranges_cover_the_ids_in_order(self):
+        ids = [1, 2, 5, 9, 10, 14, 20]
+        ranges = _shard_ranges(iter(ids), 3)
+        self.assertEqual(ranges, [[1, 9], [9, 20], [20, None]])
+        for cid in ids:
+            matching = [r for r in ranges if cid >= r[0] and (r[1] is None or cid < r[1])]
+            self.assertEqual(len(matching), 1)
+
+    def test_single_and_no_shard(self):
+        self.assertEqual(_shard_ranges([4, 8], 10), [[4, None]])
+        self.assertEqual(_shard_ranges([], 10), [])
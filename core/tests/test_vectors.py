@@ -0,0 +1,128 @@
+import shutil
+import struct
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from core.services import vectors
+from core.services.vectors import _copy_into
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\0'
+
+
+def copy_stream(ids, vectors):
+    """A binary COPY of (bigint, vector) rows, as Postgres sends it."""
+    dims = vectors.shape[1]
+    parts = [COPY_SIGNATURE, struct.pack('>ii', 0, 0)]
+    for company_id, vector in zip(ids, vectors):
+        parts.append(struct.pack('>hiq', 2, 8, company_id))
+        parts.append(struct.pack('>ihh', 4 + 4 * dims, dims, 0))
+        parts.append(np.asarray(vector, dtype='>f4').tobytes())
+    parts.append(struct.pack('>h', -1))
+    return b''.join(parts)
+
+
+def copy_cursor(data, rng):
+    """A cursor whose COPY yields `data` cut into random-sized pieces."""
+    cuts = np.sort(rng.choice(np.arange(1, len(data)), size=min(len(data) - 1, 40), replace=False))
+    pieces = [data[a:b] for a, b in zip([0, *cuts], [*cuts, len(data)])]
+
+    @contextmanager
+    def copy(sql, params):
+        yield iter(pieces)
+
+    cursor = mock.Mock()
+    cursor.copy = copy
+    return cursor
+
+
+class CopyIntoTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.ids = np.arange(100, 137, dtype=np.int64)
+        self.vectors = rng.standard_normal((len(self.ids), 6)).astype(np.float32)
+        self.data = copy_stream(self.ids, self.vectors)
+
+    def decode(self, cursor, n, dims):
+        ids = np.empty(n, dtype=np.int64)
+        vectors = np.empty((n, dims), dtype=np.float32)
+        _copy_into(cursor, 'SELECT 1', [], ids, vectors)
+        return ids, vectors
+
+    def test_decodes_stream_split_anywhere(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                cursor = copy_cursor(self.data, np.random.default_rng(seed))
+                ids, vectors = self.decode(cursor, len(self.ids), 6)
+                np.testing.assert_array_equal(ids, self.ids)
+                np.testing.assert_array_equal(vectors, self.vectors)
+
+    def test_decodes_byte_by_byte(self):
+        @contextmanager
+        def copy(sql, params):
+            yield (self.data[i:i + 1] for i in range(len(self.data)))
+
+        ids, vectors = self.decode(mock.Mock(copy=copy), len(self.ids), 6)
+        np.testing.assert_array_equal(ids, self.ids)
+        np.testing.assert_array_equal(vectors, self.vectors)
+
+    def test_rejects_other_dimensions(self):
+        cursor = copy_cursor(copy_stream(self.ids, self.vectors[:, :4]), np.random.default_rng(0))
+        with self.assertRaises(ValueError):
+            self.decode(cursor, len(self.ids), 6)
+
+    def test_missing_rows_raise(self):
+        cursor = copy_cursor(self.data, np.random.default_rng(0))
+        with self.assertRaises(RuntimeError):
+            self.decode(cursor, len(self.ids) + 1, 6)
+
+
+class WriteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def write(self, version, load):
+        with mock.patch.object(vectors, '_load', load), mock.patch('core.models.CompanyEmbedding'):
+            vectors._write_cache(
+                self.directory, version,
+                self.directory / f'{version}.ids.npy', self.directory / f'{version}.vectors.npy',
+            )
+
+    @staticmethod
+    def load(queryset, allocate):
+        ids, vecs = allocate(3, 2)
+        ids[:] = [1, 2, 3]
+        vecs[:] = 0.5
+        return ids, vecs
+
+    def names(self):
+        return sorted(path.name for path in self.directory.glob('*.npy'))
+
+    def test_publishes_and_drops_older_versions_only(self):
+        (self.directory / 'old.ids.npy').write_bytes(b'')
+        (self.directory / 'old.vectors.npy').write_bytes(b'')
+        (self.directory / 'new.ids.999.tmp.npy').write_bytes(b'')
+        self.write('new', self.load)
+
+        self.assertEqual(self.names(), ['new.ids.999.tmp.npy', 'new.ids.npy', 'new.vectors.npy'])
+        np.testing.assert_array_equal(np.load(self.directory / 'new.ids.npy'), [1, 2, 3])
+
+    def test_skips_a_version_written_while_waiting(self):
+        self.write('v1', self.load)
+        load = mock.Mock()
+        self.write('v1', load)
+        load.assert_not_called()
+
+    def test_failed_load_leaves_no_temp_files(self):
+        def failing(queryset, allocate):
+            allocate(3, 2)
+            raise RuntimeError('connection lost')
+
+        with self.assertRaises(RuntimeError):
+            self.write('v1', failing)
+        self.assertEqual(self.names(), [])
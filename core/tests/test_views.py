@@ -0,0 +1,45 @@
+import asyncio
+
+from django.test import RequestFactory, SimpleTestCase
+
+from core import views
+
+
+class SearchParameterTests(SimpleTestCase):
+    """Bad parameters are rejected before any query or encode runs."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_similar_rejects_bad_ef_and_n(self):
+        for params in ({'ef': 'abc'}, {'n': 'ten'}):
+            with self.subTest(params=params):
+                response = views.api_similar_companies(self.factory.get('/', params), 1)
+                self.assertEqual(response.status_code, 400)
+
+    def test_search_rejects_bad_ef(self):
+        request = self.factory.get('/', {'q': 'coffee roasters', 'ef': 'abc'})
+        self.assertEqual(views.api_semantic_search(request).status_code, 400)
+
+    def test_async_search_rejects_bad_ef(self):
+        request = self.factory.get('/', {'q': 'coffee roasters', 'ef': 'abc'})
+        response = asyncio.run(views.api_semantic_search_async(request))
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_options_reject_non_finite_ef(self):
+        with self.assertRaises(ValueError):
+            views._batch_options({'ef': float('inf')}, 10)
+
+    def test_ef_is_clamped(self):
+        with self.settings(VECTOR_MAX_EF_SEARCH=100):
+            self.assertEqual(views._search_options({'ef': '500'})['ef_search'], 100)
+            self.assertEqual(views._search_options({'ef': '-3'})['ef_search'], 1)
+            self.assertIsNone(views._search_options({})['ef_search'])
+
+
+class MapTilesParameterTests(SimpleTestCase):
+    def test_rejects_malformed_bbox(self):
+        for bbox in ('0,0,1', '0,0,1,x', 'nan,0,1,1', '0,-inf,1,1', '0,0,inf,1'):
+            with self.subTest(bbox=bbox):
+                response = views.api_map_tiles(RequestFactory().get('/', {'zoom': 6, 'bbox': bbox}))
+                self.assertEqual(response.status_code, 400)
@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI the search endpoints encode queries through the async micro-batcher
+if settings.SEARCH_ASYNC_VIEWS:
+    semantic_search, search_batch = views.api_semantic_search_async, views.api_search_batch_async
+else:
+    semantic_search, search_batch = views.api_semantic_search, views.api_search_batch
+
 urlpatterns = [
     path('', views.index, name='index'),
     path('map/', views.map_view, name='map_view'),
@@ -8,7 +15,11 @@ urlpatterns = [
     path('actions/scrape/', views.trigger_scraping, name='trigger_scraping'),
     path('actions/embed/', views.trigger_embedding, name='trigger_embedding'),
     path('api/map-data/', views.api_map_data, name='api_map_data'),
+    path('api/map-tiles/', views.api_map_tiles, name='api_map_tiles'),
     path('api/similar/<int:company_id>/', views.api_similar_companies, name='api_similar_companies'),
-    path('api/search/', views.api_semantic_search, name='api_semantic_search'),
+    path('api/similar/batch/', views.api_similar_batch, name='api_similar_batch'),
+    path('api/search/', semantic_search, name='api_semantic_search'),
+    path('api/search/batch/', search_batch, name='api_search_batch'),
+    path('api/search/cache-stats/', views.api_search_cache_stats, name='api_search_cache_stats'),
     path('api/company/<int:company_id>/', views.api_company_detail, name='api_company_detail'),
 ]
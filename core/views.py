@@ -1,6 +1,13 @@
+import json
+import math
+import re
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from .models import Company, ScrapedData, CompanyEmbedding
 
@@ -45,106 +52,354 @@ def trigger_embedding(request):
     return redirect('index')
 
 
-def api_map_data(request):
-    data = list(
-        CompanyEmbedding.objects.select_related('company')
-        .filter(umap_x__isnull=False)
-        .values_list(
-            'company__id', 'company__name', 'company__url',
-            'umap_x', 'umap_y',
-            'company__industry', 'cluster_id', 'cluster_label',
-        )
-    )
-    companies = [
-        {
-            'id': row[0],
-            'name': row[1],
-            'url': row[2],
-            'x': row[3],
-            'y': row[4],
-            'industry': row[5] or 'Unknown',
-            'cluster_id': row[6],
-            'cluster_label': row[7] or 'Unknown',
-        }
-        for row in data
-    ]
-    return JsonResponse({'companies': companies})
+def _map_variant(request):
+    """'json', 'binary' or 'names', from ?format=/&part= or the Accept header."""
+    from .services.map_data import CONTENT_TYPE
 
+    fmt = request.GET.get('format')
+    if fmt:
+        binary = fmt == 'binary'
+    else:
+        binary = request.accepts(CONTENT_TYPE) and not request.accepts('application/json')
+    if not binary:
+        return 'json'
+    return 'names' if request.GET.get('part') == 'names' else 'binary'
 
-def api_similar_companies(request, company_id):
-    from pgvector.django import CosineDistance
 
-    n = int(request.GET.get('n', 10))
-    n = max(1, min(n, 50))
+def _accepted_encoding(request, available):
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    for encoding in available:
+        if re.search(rf'\b{encoding}\b', accept_encoding):
+            return encoding
+    return None
+
+
+def api_map_data(request):
+    import gzip
+    from django.conf import settings
+    from django.http import FileResponse
+    from django.utils.cache import get_conditional_response, patch_cache_control
+    from .services import map_snapshot
+    from .services.map_data import VARIANTS
+    from .services.projections import active_run
+
+    variant = _map_variant(request)
+    builder, content_type = VARIANTS[variant]
+    run = active_run()
+
+    if run is None:
+        response = HttpResponse(builder(None), content_type=content_type)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    map_snapshot.ensure_snapshot(run, variant)
+    encoding = _accepted_encoding(request, map_snapshot.snapshot_encodings(run.pk, variant))
+    etag = f'"map-{run.pk}-{variant}-{encoding or "identity"}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        path = map_snapshot.snapshot_path(run.pk, variant, encoding or 'gzip')
+        if encoding:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Content-Encoding'] = encoding
+        else:
+            response = HttpResponse(gzip.decompress(path.read_bytes()), content_type=content_type)
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.MAP_CACHE_MAX_AGE)
+    patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+    return response
+
+
+def api_map_tiles(request):
+    from django.conf import settings
+    from django.utils.cache import get_conditional_response, patch_cache_control
+    from .services.projections import active_run
+    from .services.tiles import query_tile
+
+    try:
+        zoom = int(request.GET.get('zoom', 0))
+        bbox = request.GET.get('bbox')
+        bbox = [float(v) for v in bbox.split(',')] if bbox else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid zoom or bbox'}, status=400)
+    if bbox is not None and (len(bbox) != 4 or not all(map(math.isfinite, bbox))):
+        return JsonResponse({'error': 'bbox must be min_x,min_y,max_x,max_y'}, status=400)
+    # Every zoom from the detail level on returns the same points
+    zoom = max(0, min(zoom, settings.MAP_TILE_DETAIL_ZOOM))
+
+    run = active_run()
+    if run is None:
+        return JsonResponse({'run': None, 'count': 0, 'kind': 'cells', 'cells': {}})
+
+    etag = f'"tile-{run.pk}-{zoom}-{",".join(map(repr, bbox)) if bbox else "all"}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        data = query_tile(run, zoom, bbox)
+        data['full_load'] = data['count'] <= settings.MAP_FULL_LOAD_LIMIT
+        response = JsonResponse(data)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.MAP_CACHE_MAX_AGE)
+    return response
+
+
+def _search_options(params):
+    """
+    Filter and ef_search keyword arguments of nearest_embeddings from GET or
+    JSON parameters; raises ValueError on a bad ef.
+    """
+    from django.conf import settings
+
+    def value(name):
+        return str(params.get(name) or '').strip()
+
+    filters = {
+        'industry': value('industry'),
+        'country_code': value('country').upper(),
+        'state': value('state'),
+        'size': value('size'),
+    }
+    ef_search = params.get('ef')
+    if ef_search:
+        try:
+            ef_search = max(1, min(int(ef_search), settings.VECTOR_MAX_EF_SEARCH))
+        except (TypeError, OverflowError) as exc:
+            raise ValueError(f'Invalid ef {ef_search!r}') from exc
+    return {'filters': filters, 'ef_search': ef_search or None}
+
+
+def _company_result(emb, points=None):
+    """API representation of a search hit; with `points` (see points_for) its map position too."""
+    result = {
+        'id': emb.company.id,
+        'name': emb.company.name,
+        'url': emb.company.url,
+        'industry': emb.company.industry or 'Unknown',
+        'country_code': emb.country_code,
+        'state': emb.state,
+        'size': emb.size,
+        'similarity': round((1 - emb.distance) * 100, 1),
+    }
+    if points is not None:
+        point = points.get(emb.company_id)
+        result['x'] = point.umap_x if point else None
+        result['y'] = point.umap_y if point else None
+    return result
 
-    target = get_object_or_404(CompanyEmbedding, company_id=company_id)
 
-    results = (
-        CompanyEmbedding.objects
-        .exclude(company_id=company_id)
-        .annotate(distance=CosineDistance('vector', target.vector))
-        .order_by('distance')
-        .select_related('company')[:n]
+def api_similar_companies(request, company_id):
+    from .services.neighbors import precomputed_neighbors
+    from .services.search import nearest_embeddings
+
+    try:
+        n = max(1, min(int(request.GET.get('n', 10)), 50))
+        options = _search_options(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid n or ef'}, status=400)
+
+    # The vector is only loaded if the precomputed neighbours can't be used
+    target = get_object_or_404(
+        CompanyEmbedding.objects.defer('vector').select_related('company'), company_id=company_id,
     )
 
-    similar = [
-        {
-            'id': emb.company.id,
-            'name': emb.company.name,
-            'url': emb.company.url,
-            'industry': emb.company.industry or 'Unknown',
-            'similarity': round((1 - emb.distance) * 100, 1),
-        }
-        for emb in results
-    ]
+    results = None
+    if not any(options['filters'].values()) and options['ef_search'] is None:
+        results = precomputed_neighbors(target, n)
+    if results is None:
+        results = nearest_embeddings(target.vector, n, exclude_company_id=company_id, **options)
 
     company = target.company
     return JsonResponse({
         'company': {'id': company.id, 'name': company.name},
-        'similar': similar,
+        'similar': [_company_result(emb) for emb in results],
     })
 
 
-def api_semantic_search(request):
-    from pgvector.django import CosineDistance
-    from .services.embeddings import embed_text
-
+def _search_query(request):
+    """(query, n, search options) of a /api/search/ request; raises ValueError on bad values."""
     query = request.GET.get('q', '').strip()
     n = int(request.GET.get('n', 20))
-    n = max(1, min(n, 50))
+    return query, max(1, min(n, 50)), _search_options(request.GET)
+
+
+def _search_response(query, query_vector, n, options):
+    from .services.projections import points_for
+    from .services.search import nearest_embeddings
+
+    results = nearest_embeddings(query_vector, n, **options)
+    points = points_for([emb.company_id for emb in results])
 
+    companies = [_company_result(emb, points) for emb in results]
+    return JsonResponse({'query': query, 'results': companies})
+
+
+def api_semantic_search(request):
+    from .services.query_cache import get_query_embedding
+
+    try:
+        query, n, options = _search_query(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid n or ef'}, status=400)
     if not query:
         return JsonResponse({'error': 'Missing query parameter q'}, status=400)
 
-    query_vector = embed_text(query).tolist()
+    return _search_response(query, get_query_embedding(query), n, options)
 
-    results = (
-        CompanyEmbedding.objects
-        .annotate(distance=CosineDistance('vector', query_vector))
-        .order_by('distance')
-        .select_related('company')[:n]
-    )
 
-    companies = [
-        {
-            'id': emb.company.id,
-            'name': emb.company.name,
-            'url': emb.company.url,
-            'industry': emb.company.industry or 'Unknown',
-            'similarity': round((1 - emb.distance) * 100, 1),
-            'x': emb.umap_x,
-            'y': emb.umap_y,
-        }
-        for emb in results
-    ]
+async def api_semantic_search_async(request):
+    """api_semantic_search for ASGI: the query is encoded by the micro-batcher."""
+    from asgiref.sync import sync_to_async
+    from .services.query_cache import aget_query_embedding
 
-    return JsonResponse({'query': query, 'results': companies})
+    try:
+        query, n, options = _search_query(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid n or ef'}, status=400)
+    if not query:
+        return JsonResponse({'error': 'Missing query parameter q'}, status=400)
+
+    query_vector = await aget_query_embedding(query)
+    return await sync_to_async(_search_response)(query, query_vector, n, options)
+
+
+def _batch_payload(request, key):
+    """(JSON body, None) of a batch request whose `key` is a list, or (None, 400 response)."""
+    from django.conf import settings
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return None, JsonResponse({'error': 'Request body must be JSON'}, status=400)
+    if not isinstance(payload, dict) or not isinstance(payload.get(key), list):
+        return None, JsonResponse({'error': f'Missing list {key!r}'}, status=400)
+    if len(payload[key]) > settings.SEARCH_BATCH_MAX_ITEMS:
+        return None, JsonResponse(
+            {'error': f'At most {settings.SEARCH_BATCH_MAX_ITEMS} {key} per request'}, status=400,
+        )
+    return payload, None
+
+
+def _batch_options(payload, default_n):
+    """(n, search options) of a batch request; raises ValueError on bad values."""
+    try:
+        n = max(1, min(int(payload.get('n', default_n)), 50))
+        return n, _search_options(payload)
+    except (TypeError, OverflowError) as exc:
+        raise ValueError(exc)
+
+
+@csrf_exempt
+@require_POST
+def api_similar_batch(request):
+    """
+    Similar companies of many companies in one request:
+    {"ids": [...], "n": 10, filters as in /api/similar/}. Ids without an
+    embedding get an inline error.
+    """
+    from .services.search import similar_embeddings_batch
+
+    payload, error = _batch_payload(request, 'ids')
+    if error:
+        return error
+    try:
+        n, options = _batch_options(payload, 10)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid n or ef'}, status=400)
+
+    def valid(company_id):
+        return type(company_id) is int and 0 < company_id < 2 ** 63
+
+    ids = payload['ids']
+    distinct = list(dict.fromkeys(company_id for company_id in ids if valid(company_id)))
+    found = dict(zip(distinct, similar_embeddings_batch(distinct, n, **options)))
+
+    items = []
+    for company_id in ids:
+        results = found.get(company_id) if valid(company_id) else None
+        if not valid(company_id):
+            items.append({'id': company_id, 'error': 'Invalid company id'})
+        elif results is None:
+            items.append({'id': company_id, 'error': 'Company not found or not embedded'})
+        else:
+            items.append({'id': company_id, 'similar': [_company_result(emb) for emb in results]})
+    return JsonResponse({'results': items})
+
+
+def _search_batch_request(request):
+    """((n, options, raw queries, distinct queries), None) of a batch search, or (None, 400 response)."""
+    payload, error = _batch_payload(request, 'queries')
+    if error:
+        return None, error
+    try:
+        n, options = _batch_options(payload, 20)
+    except ValueError:
+        return None, JsonResponse({'error': 'Invalid n or ef'}, status=400)
+
+    raw = payload['queries']
+    distinct = list(dict.fromkeys(query.strip() for query in raw if isinstance(query, str) and query.strip()))
+    return (n, options, raw, distinct), None
+
+
+def _search_batch_response(raw, distinct, vectors, n, options):
+    from .services.projections import points_for
+    from .services.search import nearest_embeddings_batch
+
+    found = dict(zip(distinct, nearest_embeddings_batch(vectors, n, **options)))
+    points = points_for({emb.company_id for results in found.values() for emb in results})
+
+    items = []
+    for query in raw:
+        if not isinstance(query, str) or query.strip() not in found:
+            items.append({'query': query, 'error': 'Queries must be non-empty strings'})
+        else:
+            query = query.strip()
+            items.append({'query': query, 'results': [_company_result(emb, points) for emb in found[query]]})
+    return JsonResponse({'results': items})
+
+
+@csrf_exempt
+@require_POST
+def api_search_batch(request):
+    """
+    Semantic search for many queries in one request:
+    {"queries": [...], "n": 20, filters as in /api/search/}. Queries are
+    encoded in one model batch; empty ones get an inline error.
+    """
+    from .services.query_cache import get_query_embeddings
+
+    parsed, error = _search_batch_request(request)
+    if error:
+        return error
+    n, options, raw, distinct = parsed
+    return _search_batch_response(raw, distinct, get_query_embeddings(distinct), n, options)
+
+
+@csrf_exempt
+@require_POST
+async def api_search_batch_async(request):
+    """api_search_batch for ASGI: queries are encoded by the micro-batcher."""
+    from asgiref.sync import sync_to_async
+    from .services.query_cache import aget_query_embeddings
+
+    parsed, error = _search_batch_request(request)
+    if error:
+        return error
+    n, options, raw, distinct = parsed
+    vectors = await aget_query_embeddings(distinct)
+    return await sync_to_async(_search_batch_response)(raw, distinct, vectors, n, options)
+
+
+def api_search_cache_stats(request):
+    from .services.query_cache import cache_stats
+    return JsonResponse(cache_stats())
 
 
 def api_company_detail(request, company_id):
+    from .services.projections import active_points
+
     company = get_object_or_404(Company, id=company_id)
     scraped = company.scraped_data.first()
     embedding = getattr(company, 'embedding', None)
+    point = active_points().filter(company=company).first()
 
     data = {
         'id': company.id,
@@ -161,7 +416,7 @@ def api_company_detail(request, company_id):
         'scrape_status': company.scrape_status,
         'has_scraped_data': scraped is not None,
         'has_embedding': embedding is not None,
-        'cluster_id': embedding.cluster_id if embedding else None,
-        'cluster_label': embedding.cluster_label if embedding else None,
+        'cluster_id': point.cluster_id if point else None,
+        'cluster_label': point.cluster_label if point else None,
     }
     return JsonResponse(data)